@@ -2,10 +2,18 @@ import asyncio
 import datetime
 import json
 from pprint import pprint
+import os
+import random
+import time
 from urllib.parse import quote
 import aiohttp
 
-RASP_URL = 'https://rasp.omgtu.ru/'
+import cache
+import metrics
+from lessons import Lesson, Schedule, approx_size, as_date, decode, encode, \
+    parse_schedule
+
+RASP_URL = os.environ.get('RASP_URL', 'https://rasp.omgtu.ru/')
 RASP_CONFIG = RASP_URL + 'ruz/assets/config/config.json'
 LANG_CONFIG = RASP_URL + 'ruz/assets/i18n/ru.json'
 SEARCH_BASE_URL = RASP_URL + 'api/search?term={}'
@@ -24,15 +32,149 @@ async def get_schedule(
         id_: int | str,
         search_type='group',
         dates: str | tuple[str, str] | tuple[datetime.date, datetime.date] = ()
-) -> list[dict]:
+) -> list[Lesson] | None:
+    """Schedule for date range.
+
+    Upstream is always asked for whole weeks (see ``get_week_schedule``),
+    so today, tomorrow and week of same entity are served from one fetch.
+    """
+    if dates and not isinstance(dates, str):
+        start, finish = as_date(dates[0]), as_date(dates[-1])
+        week_start = week_from_date(start)[0]
+        weeks = []
+        while week_start <= finish:
+            weeks.append(week_start)
+            week_start += datetime.timedelta(days=7)
+        results = await asyncio.gather(*(
+            get_week_schedule(id_, search_type, week) for week in weeks
+        ))
+        if any(week is None for week in results):
+            return None
+        return Schedule(
+            (lesson for week in results for lesson in week
+             if start <= lesson.date <= finish),
+            fetched_at=min(getattr(week, 'fetched_at', None) or time.time()
+                           for week in results)
+        )
     url = SCHEDULE_URL.format(search_type, id_)
     if dates:
-        if isinstance(dates, str):
-            url += ('start=' + dates)
-        else:
-            start, finish = str(dates[0]), str(dates[-1])
-            url += f'start={quote(start)}&finish={quote(finish)}'
-    return await get_data(url)
+        url += ('start=' + dates)
+    return await schedule_cache.get_or_fetch(
+        schedule_cache_key(id_, search_type, dates or ''),
+        lambda: _get_lessons(url)
+    )
+
+
+async def get_week_schedule(id_: int | str, search_type: str,
+                            week_start: datetime.date) -> list[Lesson] | None:
+    """Whole ISO week (monday - sunday) schedule.
+
+    Cached in memory (or redis) and stored in db: when upstream is down,
+    last known schedule is served.
+    """
+    import db
+    start, finish = week_from_date(week_start)
+    url = SCHEDULE_URL.format(search_type, id_) + \
+        f'start={quote(str(start))}&finish={quote(str(finish))}'
+
+    async def fetch():
+        lessons = await _get_lessons(url)
+        if lessons is not None:
+            await db.ScheduleWeek.save(search_type, int(id_), start,
+                                       encode(lessons), lessons.fetched_at)
+        return lessons
+
+    async def stored():
+        week = await db.ScheduleWeek.get(search_type, int(id_), start)
+        if week is None:
+            return None
+        return Schedule(decode(week.lessons), week.fetched_at), \
+            week.fetched_at
+
+    return await schedule_cache.get_or_fetch(
+        schedule_cache_key(id_, search_type, str(start), str(finish)),
+        fetch, fallback=stored
+    )
+
+
+async def _get_lessons(url: str) -> Schedule | None:
+    lessons = parse_schedule(await get_data(url))
+    return None if lessons is None else Schedule(lessons, time.time())
+
+
+async def refresh_week(id_: int | str, search_type: str,
+                       week_start: datetime.date,
+                       validators: dict[str, str] | None = None
+                       ) -> tuple[Schedule | None, dict[str, str]]:
+    """Fetches week from upstream bypassing cache (conditionally, if
+    ``validators`` are given) and updates cache and db with it.
+
+    Returns (lessons or None if not modified/failed, new validators).
+    """
+    import db
+    start, finish = week_from_date(week_start)
+    url = SCHEDULE_URL.format(search_type, id_) + \
+        f'start={quote(str(start))}&finish={quote(str(finish))}'
+    modified, data, validators = await client.get_conditional(url,
+                                                              validators)
+    if not modified:  # Cache and db already have it.
+        return None, validators
+    lessons = parse_schedule(data)
+    if lessons is None:
+        return None, validators
+    lessons = Schedule(lessons, time.time())
+    await schedule_cache.set(
+        schedule_cache_key(id_, search_type, str(start), str(finish)),
+        lessons)
+    await db.ScheduleWeek.save(search_type, int(id_), start,
+                               encode(lessons), lessons.fetched_at)
+    return lessons, validators
+
+
+def outdated_since(schedule: list[Lesson]) -> datetime.datetime | None:
+    """When schedule was fetched, if it was too long ago to be trusted
+    (it's served from db, because upstream is down)"""
+    fetched_at = getattr(schedule, 'fetched_at', None)
+    if fetched_at is None or time.time() - fetched_at <= \
+            schedule_cache.ttl + schedule_cache.stale_ttl:
+        return None
+    return datetime.datetime.fromtimestamp(fetched_at)
+
+
+async def warm_schedule_cache() -> int:
+    """Loads stored weeks (current and next ones) into cache, so after
+    restart they are served at once and refreshed in background.
+    Weeks too old to be served from cache are skipped"""
+    import db
+    count = 0
+    oldest = time.time() - schedule_cache.ttl - schedule_cache.stale_ttl
+    for week in await db.ScheduleWeek.since(
+            week_from_date(datetime.date.today())[0]):
+        if week.fetched_at < oldest:
+            continue
+        start, finish = week_from_date(week.week_start)
+        key = schedule_cache_key(week.entity_id, week.search_type,
+                                 str(start), str(finish))
+        if await schedule_cache.contains(key):
+            continue
+        await schedule_cache.set(
+            key, Schedule(decode(week.lessons), week.fetched_at),
+            week.fetched_at
+        )
+        count += 1
+    return count
+
+
+def schedule_cache_key(id_: int | str, search_type: str,
+                       start: str = '', finish: str = '') -> str:
+    return f'schedule:{search_type}:{id_}:{start}:{finish}'
+
+
+def week_from_date(date_: datetime.date):
+    today = date_
+    start = today - datetime.timedelta(days=today.weekday())
+    finish = start + datetime.timedelta(days=6)
+    return start, finish
 
 
 async def search(term: str, search_type: str) -> list[dict[str, str | int]]:
@@ -41,21 +183,288 @@ async def search(term: str, search_type: str) -> list[dict[str, str | int]]:
     return await get_data(url)
 
 
-async def get_data(url: str) -> dict | list | None:
+class CircuitBreaker:
+    """Stops calling upstream after ``failure_threshold`` failures in a row.
+
+    Open breaker rejects calls for ``reset_timeout`` seconds, then lets one
+    probe call through (half-open): its success closes breaker, failure
+    opens it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        # When probe was let through. Cancelled probe doesn't report back,
+        # so after reset_timeout another one is allowed.
+        self._probe_at: float | None = None
+        self.stats = {'opened': 0, 'rejected': 0}
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if state == self.HALF_OPEN and (
+                self._probe_at is None
+                or now - self._probe_at >= self.reset_timeout):
+            self._probe_at = now
+            return True
+        self.stats['rejected'] += 1
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        probing = self._probe_at is not None
+        if probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or probing:
+                self.stats['opened'] += 1
+            self.opened_at = time.monotonic()
+            self._probe_at = None
+
+    def snapshot(self) -> dict[str, str | int | float]:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'open_for': round(time.monotonic() - self.opened_at, 1)
+            if self.opened_at is not None else 0,
+            **self.stats,
+        }
+
+
+class UpstreamError(Exception):
+    """Response worth retrying (5xx)"""
+
+
+class ApiClient:
+    """Long-living HTTP client for rasp.omgtu.ru.
+
+    Keeps one aiohttp session (and its keep-alive connection pool) for the
+    whole process, so every request doesn't pay for new TCP+TLS handshake.
+
+    Requests are GETs, so failed ones (network errors, timeouts, 5xx) are
+    retried with jittered exponential backoff, all attempts together fit
+    in ``deadline``. Circuit breaker fails requests fast while upstream is
+    down (callers serve cached schedules then).
+    """
+
+    def __init__(
+            self,
+            limit: int = int(os.environ.get('RASP_POOL_LIMIT', 100)),
+            limit_per_host: int = int(
+                os.environ.get('RASP_POOL_LIMIT_PER_HOST', 30)),
+            dns_ttl: int = int(os.environ.get('RASP_DNS_TTL', 300)),
+            timeout: float = float(os.environ.get('RASP_TIMEOUT', 15)),
+            connect_timeout: float = float(
+                os.environ.get('RASP_CONNECT_TIMEOUT', 5)),
+            keepalive_timeout: float = float(
+                os.environ.get('RASP_KEEPALIVE_TIMEOUT', 30)),
+            retries: int = int(os.environ.get('RASP_RETRIES', 2)),
+            backoff: float = float(os.environ.get('RASP_BACKOFF', 0.5)),
+            backoff_max: float = float(os.environ.get('RASP_BACKOFF_MAX', 4)),
+            deadline: float = float(os.environ.get('RASP_DEADLINE', 20)),
+            breaker: CircuitBreaker | None = None,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=timeout,
+                                             connect=connect_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker(
+            int(os.environ.get('RASP_BREAKER_THRESHOLD', 5)),
+            float(os.environ.get('RASP_BREAKER_RESET', 30)),
+        )
+        self._session: aiohttp.ClientSession | None = None
+        # Concurrent identical requests are sent once.
+        self.single_flight = cache.SingleFlight()
+        self.stats = {
+            'requests': 0,
+            'errors': 0,
+            'retries': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+        }
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(*_args):
+            self.stats['requests'] += 1
+
+        async def on_connection_create_end(*_args):
+            self.stats['connections_created'] += 1
+
+        async def on_connection_reuseconn(*_args):
+            self.stats['connections_reused'] += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                trace_configs=[self._trace_config()],
+            )
+        return self._session
+
+    async def start(self):
+        """Creates session. Must be called from running event loop"""
+        return self.session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def connection_stats(self) -> dict[str, int | float]:
+        stats = dict(self.stats)
+        total = stats['connections_created'] + stats['connections_reused']
+        stats['reuse_ratio'] = (
+            stats['connections_reused'] / total if total else 0.0
+        )
+        stats['breaker'] = self.breaker.snapshot()
+        return stats
+
+    async def _get(self, url: str, headers: dict[str, str] | None = None
+                   ) -> tuple[int, dict, dict | list | None] | None:
+        """(status, headers, json) or None if upstream failed (or breaker
+        is open)"""
+        if not self.breaker.allow():
+            metrics.UPSTREAM_REJECTED.inc()
+            return None
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            timeout = aiohttp.ClientTimeout(
+                total=min(self.timeout.total, remaining),
+                connect=self.timeout.connect
+            )
+            started = time.perf_counter()
+            try:
+                async with self.session.get(url, headers=headers,
+                                            timeout=timeout) as resp:
+                    if resp.status >= 500:
+                        raise UpstreamError(resp.status)
+                    # 304, 404: upstream is fine, there's just no json.
+                    data = None if resp.status == 304 or resp.status >= 400 \
+                        else await _read_json(resp)
+                    self.breaker.record_success()
+                    metrics.UPSTREAM_SECONDS.labels(resp.status).observe(
+                        time.perf_counter() - started)
+                    return resp.status, resp.headers, data
+            except (aiohttp.ClientError, asyncio.TimeoutError,
+                    UpstreamError) as exc:
+                self.stats['errors'] += 1
+                metrics.UPSTREAM_SECONDS.labels(type(exc).__name__).observe(
+                    time.perf_counter() - started)
+            delay = random.uniform(
+                0, min(self.backoff_max, self.backoff * 2 ** attempt))
+            attempt += 1
+            if attempt > self.retries or \
+                    time.monotonic() + delay >= deadline:
+                self.breaker.record_failure()
+                return None
+            self.stats['retries'] += 1
+            await asyncio.sleep(delay)
+
+    async def _get_once(self, url: str,
+                        headers: dict[str, str] | None = None
+                        ) -> tuple[int, dict, dict | list | None] | None:
+        """``_get``, concurrent requests of url share one"""
+        return await self.single_flight.do(url,
+                                           lambda: self._get(url, headers))
+
+    async def get_data(self, url: str) -> dict | list | None:
+        res = await self._get_once(url)
+        if res is not None and res[0] == 304:  # Joined conditional one.
+            res = await self._get(url)
+        return None if res is None else res[2]
+
+    async def get_conditional(
+            self, url: str, validators: dict[str, str] | None = None
+    ) -> tuple[bool, dict | list | None, dict[str, str]]:
+        """Conditional GET (if upstream gave ETag/Last-Modified before).
+
+        Returns (modified, data, validators for next request). Data is None
+        if not modified or on error.
+        """
+        validators = validators or {}
+        headers = {}
+        if etag := validators.get('etag'):
+            headers['If-None-Match'] = etag
+        if last_modified := validators.get('last_modified'):
+            headers['If-Modified-Since'] = last_modified
+        res = await self._get_once(url, headers)
+        if res is None:
+            return True, None, validators
+        status, resp_headers, data = res
+        if status == 304:
+            return False, None, validators
+        new_validators = {
+            'etag': resp_headers.get('ETag'),
+            'last_modified': resp_headers.get('Last-Modified'),
+        }
+        return True, data, {k: v for k, v in new_validators.items() if v}
+
+
+async def _read_json(resp: aiohttp.ClientResponse):
     try:
-        async with aiohttp.ClientSession() as s:
-            async with s.get(url) as resp:
-                try:
-                    return await resp.json()
-                except json.JSONDecodeError:
-                    return await resp.json(encoding='utf-8-sig')
-    except aiohttp.ClientError as _exc:
-        return None
+        return await resp.json()
+    except json.JSONDecodeError:
+        return await resp.json(encoding='utf-8-sig')
+
+
+client = ApiClient()
+schedule_cache = cache.TTLCache(
+    cache.MemoryBackend(sizeof=approx_size),
+    ttl=float(os.environ.get('SCHEDULE_CACHE_TTL', 600)),
+    stale_ttl=float(os.environ.get('SCHEDULE_CACHE_STALE_TTL', 3600)),
+)
+
+
+async def get_data(url: str) -> dict | list | None:
+    return await client.get_data(url)
 
 
 async def main():
     rasp = await search('п', SearchType.GROUP)
     pprint(rasp)
+    pprint(client.connection_stats())
+    await client.close()
 
 
 if __name__ == '__main__':
@@ -1,44 +1,59 @@
+import time
+
+_import_started = time.perf_counter()
+
+import asyncio
+import importlib
 import logging
 import os
 import sys
 
+if __name__ == '__main__':
+    # Before modules below read their settings from env on import.
+    from dotenv import load_dotenv
+    load_dotenv()
+
 import aiogram.exceptions
-import dateutil.parser
-from aiogram import Bot, Dispatcher, types, F
+from aiogram import Bot, Dispatcher, Router, types, F
 from aiogram.exceptions import TelegramBadRequest
-from aiogram.filters import Command, StateFilter
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.storage.base import StorageKey
 from aiogram.types import Message, CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.fsm.storage.redis import RedisStorage
-import redis.asyncio as redis
-from dotenv import load_dotenv
 import api
-import db
+import cache
+import notifier
+import lessons
+import logs
+import metrics
+from cleanup import cleaner
+from message_store import MessageStore
+from outbound import OutboundLimiter
+from render import generate_schedule_str
+from search_index import local_search
 
 import datetime
 
+log = logging.getLogger(__name__)
 
-load_dotenv()
 
-log_path = os.environ.get('LOG_PATH', '.')
-log_filename = os.environ.get('LOG_FILE', 'rasp_bot_log.log')
-log_formatter = logging.Formatter(
-    '%(asctime)s [%(threadName)-12.12s] [%(levelname)-5.5s]  %(message)s'
-)
-log = logging.getLogger(__name__)
-file_handler = logging.FileHandler("{0}/{1}.log".format(log_path, log_filename))
-file_handler.setFormatter(log_formatter)
-log.addHandler(file_handler)
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(log_formatter)
-log.addHandler(console_handler)
+class _LazyModule:
+    """Imports module on first attribute access"""
+
+    def __init__(self, name: str):
+        self._name = name
 
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
 
-TOKEN = os.environ.get('TELEGRAM_TOKEN')
-if not TOKEN:
-    raise Exception('Telegram token not provided,'
-                    ' please add TELEGRAM_TOKEN to env vars.')
+
+# SQLAlchemy (~0.4s) is imported on first query (on startup), not with bot.
+db = _LazyModule('db')
+
+# Set by create_app (from env).
+PROFILING = False
+# Chat ids allowed to use admin commands (/profile).
+ADMIN_IDS: set[int] = set()
 
 
 class FSMPrefixes:
@@ -59,6 +74,9 @@ class Callbacks:
     MY_TODAY_SCHEDULE = f'{FSMPrefixes.MY}schedule@today'
     MY_TOMORROW_SCHEDULE = f'{FSMPrefixes.MY}schedule@tomorrow'
     MY_WEEK_SCHEDULE = f'{FSMPrefixes.MY}schedule@week'
+    NOTIFY_PREFIX = 'notify@'
+    NOTIFY_MENU = f'{NOTIFY_PREFIX}menu'
+    NOTIFY_OFF = f'{NOTIFY_PREFIX}off'
 
 
 class FSMStates:
@@ -78,9 +96,16 @@ class FSMStates:
     # SCHEDULE_NEXT_WEEK = f'{FSMPrefixes.SCHEDULE_PREFIX}'
 
 
-dp = Dispatcher(storage=RedisStorage(redis.Redis()))
-_bot = Bot(TOKEN, parse_mode="HTML")
-bot: Bot = _bot
+# Handlers are registered on router at import; dispatcher, bot and their
+# connections are built by create_app.
+router = Router(name='bot')
+dp: Dispatcher | None = None
+bot: Bot | None = None
+redis_client = None
+message_store: MessageStore | None = None
+outbound_limiter: OutboundLimiter | None = None
+background_tasks: set[asyncio.Task] = set()
+cold_start: dict[str, float] = {}
 
 cancel_button = InlineKeyboardBuilder(). \
     button(text='Отмена', callback_data=FSMStates.CANCEL_ALL).as_markup()
@@ -102,102 +127,35 @@ def _key(query_data: CallbackQuery | Message):
         )
 
 
-def generate_schedule_str(schedule: list[dict], dates=()) -> str:
-    res = ''
-    dates_dict = {}
-
-    for elect in schedule:
-        try:
-            date = datetime.datetime.strptime(elect.get('date'),
-                                              '%Y.%m.%d').date()
-        except (ValueError, TypeError):
-            date = elect.get('date')
-        if date is None:
-            continue
-        if date in dates_dict:
-            dates_dict[date].append(elect)
-        else:
-            dates_dict.update({date: [elect]})
-    if dates:
-        start = dates[0]
-        if not isinstance(start, datetime.date):
-            start = dateutil.parser.parse(start).date()
-        finish = dates[-1]
-        if not isinstance(start, datetime.date):
-            finish = dateutil.parser.parse(start).date()
-        dates_dict = {k: v for k, v in dates_dict.items() if
-                      start <= k <= finish}
-    for date in dates_dict:
-        res += str(date) + '\n'
-        for elect in dates_dict[date]:
-            res += (f'\t\t<u>{elect.get("beginLesson")}</u> '
-                    f'<b>{elect.get("discipline")}</b>'
-                    f'\n')
-            res += ('\t\t' + elect.get('lecturer') + ' ('
-                    + elect.get("auditorium") + ') \n')
-        res += '\n\n'
-    return res
-
-
 async def set_menu_message(key: StorageKey, msg: Message):
-    data = await dp.storage.get_data(key)
-    prev = data.get('menu_messages', [])
-    prev.append(msg.message_id)
-    return await dp.storage.update_data(key, {'menu_messages': prev})
+    return await message_store.add_menu(key, msg.message_id)
 
 
 async def delete_menu_messages(key: StorageKey):
-    data = await dp.storage.get_data(key)
-    prev = data.get('menu_messages', [])
-    for msg_id in prev:
-        await delete_user_message(key, msg_id)
-    return await dp.storage.update_data(key, {'menu_messages': []})
+    cleaner.delete(key.chat_id, await message_store.pop_menu(key))
 
 
 async def set_last_schedule_message(key: StorageKey, msg: Message):
-    return await dp.storage.update_data(key, {
-        'last_schedule': msg.message_id
-    })
+    return await message_store.set_last_schedule(key, msg.message_id)
 
 
 async def add_to_delete_message(key: StorageKey, msg: Message):
-    res = await dp.storage.get_data(key)
-    res = res.get('messages_delete_after', [])
-    res.append(msg.message_id)
-    print('SAVED', res)
-    await dp.storage.update_data(key, {'messages_delete_after': list(set(res))})
+    await message_store.add_to_delete(key, msg.message_id)
+    log.debug('Message saved to delete', extra={
+        'chat_id': key.chat_id, 'message_id': msg.message_id})
 
 
 async def delete_previous_messages_markup(key: StorageKey):
-    print('REMOVE!')
-    res = await dp.storage.get_data(key)
-    last_schedule = res.get('last_schedule', -100)
-    res = res.get('messages_delete_after', [])
-    for message in res:
-        try:
-            if message == last_schedule:
-                continue
-            n = await bot.delete_message(key.chat_id, message)
-            print(message, n)
-        except TelegramBadRequest:
-            pass
-    await dp.storage.update_data(key, {'messages_delete_after': []})
+    """Deletion itself is done in background by cleaner"""
+    to_delete = await message_store.pop_to_delete(key)
+    log.debug('Messages to delete', extra={'chat_id': key.chat_id,
+                                           'message_ids': to_delete})
+    cleaner.delete(key.chat_id, to_delete)
 
 
 async def delete_last_schedule_message(key):
-    data = await dp.storage.get_data(key)
-    if last := data.get('last_schedule'):
+    if last := await message_store.pop_last_schedule(key):
         await delete_user_message(key, last)
-    return await dp.storage.update_data(key, {
-        'last_schedule': None
-    })
-
-
-def week_from_date(date_: datetime.date):
-    today = date_
-    start = today - datetime.timedelta(days=today.weekday())
-    finish = start + datetime.timedelta(days=6)
-    return start, finish
 
 
 def __add_cancel_button(builder: InlineKeyboardBuilder):
@@ -221,10 +179,26 @@ def construct_menu():
                    callback_data=FSMStates.GROUP_SCHEDULE_GENERAL)
     builder.button(text='Поиск расписания по преподавателю',
                    callback_data=FSMStates.SCHEDULE_TEACHER_GENERAL)
+    builder.button(text='Рассылка расписания',
+                   callback_data=Callbacks.NOTIFY_MENU)
     builder.adjust(1, repeat=True)
     return builder.as_markup()
 
 
+def construct_notify_keyboard():
+    builder = InlineKeyboardBuilder()
+    for notify_time in notifier.NOTIFY_TIMES:
+        builder.button(
+            text=f'{notify_time} (на '
+                 f'{"сегодня" if int(notify_time[:2]) < 12 else "завтра"})',
+            callback_data=f'{Callbacks.NOTIFY_PREFIX}{notify_time}'
+        )
+    builder.button(text='Отключить рассылку',
+                   callback_data=Callbacks.NOTIFY_OFF)
+    __add_cancel_button(builder)
+    return builder
+
+
 def construct_weeks_keyboard():
     builder = InlineKeyboardBuilder()
     builder.button(text='Текущая неделя',
@@ -266,7 +240,9 @@ async def return_schedule(
         when: str = None,
         teacher_id: int = None
 ):
-    print('schedule', f'{group_id=}', f'{teacher_id=}')
+    log.debug('Schedule requested', extra={'group_id': group_id,
+                                           'teacher_id': teacher_id,
+                                           'dates': dates})
     entity_type = api.SearchType.GROUP if group_id else api.SearchType.TEACHER
     handler = query_data or message
     message = message or query_data.message
@@ -289,7 +265,8 @@ async def return_schedule(
     if not str_schedule:
         msg = await message.answer(
             text=f"На {str_date} для {entities_placeholders.get(entity_type)} "
-                 f"<b>{entity.label}</b> пар не найдено",
+                 f"<b>{entity.label}</b> пар не найдено" if schedule is not None
+            else 'Сайт расписания сейчас недоступен, попробуйте позже.',
         )
         await delete_last_schedule_message(key)
         await set_last_schedule_message(key, msg)
@@ -299,6 +276,10 @@ async def return_schedule(
     else:
         str_schedule = f'Расписание {entities_placeholders.get(entity_type)} <b>{entity.label}</b>' \
                        f' на {str_date} {"(" + str(dates[0]).replace("-", ".") + ")" if when != "week" else ""}\n\n' + str_schedule
+        if outdated := api.outdated_since(schedule):
+            str_schedule += ('<i>Сайт расписания недоступен, расписание '
+                             f'показано по состоянию на '
+                             f'{outdated:%d.%m.%Y %H:%M}</i>')
         await delete_last_schedule_message(key)
         if query_data:
             try:
@@ -321,7 +302,7 @@ async def delete_user_message(key: StorageKey, message_id: int):
         pass
 
 
-@dp.message(Command(commands=["start"]))
+@router.message(Command(commands=["start"]))
 async def command_start_handler(
         message: Message = None, query_data: CallbackQuery | None = None
 ) -> Message:
@@ -342,7 +323,23 @@ async def command_start_handler(
     return res
 
 
-@dp.message(StateFilter(FSMStates.MY_SCHEDULE_WEEK, FSMStates.SCHEDULE_WEEK))
+@router.message(Command(commands=['profile']), F.from_user.id.in_(ADMIN_IDS))
+async def profile_handler(message: Message, command: CommandObject):
+    """/profile [seconds]: sampling profiler snapshot (profiling mode)"""
+    if not PROFILING:
+        await message.answer('Профилирование выключено (PROFILING=1).')
+        return
+    seconds = float(command.args) if command.args and \
+        command.args.strip().replace('.', '', 1).isdigit() else 10
+    from profiler import profiler
+    if profiler.snapshot(seconds) is None:
+        await message.answer('Профилирование уже идет.')
+        return
+    await message.answer(f'Профилирование {seconds:g} с, результат будет '
+                         f'в {profiler.directory}.')
+
+
+@router.message(StateFilter(FSMStates.MY_SCHEDULE_WEEK, FSMStates.SCHEDULE_WEEK))
 async def input_week(message: Message | CallbackQuery):
     # TODO: currently can't handle week requests for any group. FIX.
     key = _key(message)
@@ -354,6 +351,7 @@ async def input_week(message: Message | CallbackQuery):
         group_id = (await dp.storage.get_data(key)).get('group')
         if not group_id:
             teacher_id = (await dp.storage.get_data(key)).get('teacher')
+    import dateutil.parser
     try:
         date = dateutil.parser.parse(message.text.strip()).date()
     except dateutil.parser.ParserError:
@@ -366,7 +364,7 @@ async def input_week(message: Message | CallbackQuery):
         await delete_user_message(_key(message), message.message_id)
         await add_to_delete_message(_key(message), to_delete)
         return
-    start, finish = week_from_date(date)
+    start, finish = api.week_from_date(date)
     if group_id:
         await return_schedule(message=message, dates=(start, finish),
                               group_id=int(group_id), when='week')
@@ -376,7 +374,7 @@ async def input_week(message: Message | CallbackQuery):
 
 
 # @dp.callback_query(F.data.startswith(FSMPrefixes.HANDLER), )
-@dp.callback_query(F.data.startswith(FSMPrefixes.HANDLER))
+@router.callback_query(F.data.startswith(FSMPrefixes.HANDLER))
 async def handle_week_handler_button_pressed(query_data: CallbackQuery):
     # It's case if we clicked current or next week button.
     key = _key(query_data)
@@ -396,10 +394,10 @@ async def handle_week_handler_button_pressed(query_data: CallbackQuery):
             raise Exception(f'Error, unknown week button: {err=}')
     match query_data.data:
         case FSMStates.SCHEDULE_WEEK_CURRENT:
-            start, finish = week_from_date(
+            start, finish = api.week_from_date(
                 datetime.date.today())
         case FSMStates.SCHEDULE_WEEK_NEXT:
-            start, finish = week_from_date(
+            start, finish = api.week_from_date(
                 datetime.date.today() + datetime.timedelta(
                     days=7)
             )
@@ -420,7 +418,7 @@ async def handle_week_handler_button_pressed(query_data: CallbackQuery):
     )
 
 
-@dp.callback_query(F.data.in_([
+@router.callback_query(F.data.in_([
     Callbacks.TEACHER_TODAY_SCHEDULE,
     Callbacks.TEACHER_TOMORROW_SCHEDULE,
     Callbacks.TEACHER_WEEK_SCHEDULE,
@@ -493,7 +491,7 @@ async def get_schedule_handler(query_data: CallbackQuery):
     # await delete_user_message(key, query_data.message.message_id)
 
 
-@dp.callback_query(F.data.in_([
+@router.callback_query(F.data.in_([
     FSMStates.GROUP_SCHEDULE_GENERAL,
     FSMStates.SCHEDULE_TEACHER_GENERAL
 ]))
@@ -511,7 +509,7 @@ async def pick_group_pressed(query_data: CallbackQuery):
             await add_to_delete_message(key, query_data.message)
 
 
-@dp.callback_query(StateFilter(FSMStates.CREATE_PROFILE))
+@router.callback_query(StateFilter(FSMStates.CREATE_PROFILE))
 async def on_create_profile_group_setter(query_data: CallbackQuery):
     key = _key(query_data)
     match query_data.data.split(':'):
@@ -543,7 +541,47 @@ async def on_create_profile_group_setter(query_data: CallbackQuery):
             await add_to_delete_message(key, msg)
 
 
-@dp.callback_query()
+@router.callback_query(F.data.startswith(Callbacks.NOTIFY_PREFIX))
+async def notify_pressed(query_data: CallbackQuery):
+    """Daily schedule subscription settings"""
+    key = _key(query_data)
+    profile = await db.get_profile(query_data.message.chat.id)
+    if not profile or not profile.group_id:
+        await query_data.message.edit_text(
+            text='Мы не знаем вашу группу, чтобы присылать ваше расписание.'
+                 ' Задайте группу в настройках.',
+            reply_markup=construct_menu()
+        )
+        return
+    match query_data.data:
+        case Callbacks.NOTIFY_MENU:
+            current = f'Сейчас расписание присылается в ' \
+                      f'<b>{profile.notify_time}</b> (пн - сб).' \
+                if profile.notify_time else 'Сейчас рассылка отключена.'
+            await query_data.message.edit_text(
+                f'{current}\nКогда присылать ваше расписание?',
+                reply_markup=construct_notify_keyboard().as_markup()
+            )
+            await add_to_delete_message(key, query_data.message)
+            return
+        case Callbacks.NOTIFY_OFF:
+            await db.set_subscription(key.chat_id, None)
+            text = 'Рассылка отключена.'
+        case _:
+            notify_time = query_data.data.removeprefix(
+                Callbacks.NOTIFY_PREFIX)
+            if notify_time not in notifier.NOTIFY_TIMES:
+                await query_data.answer('Неизвестное время рассылки.')
+                return
+            await db.set_subscription(key.chat_id, notify_time)
+            text = (f'Теперь расписание будет приходить в '
+                    f'<b>{notify_time}</b> с понедельника по субботу.')
+    await query_data.message.edit_text(text=text)
+    msg = await command_start_handler(message=query_data.message)
+    await add_to_delete_message(key, msg)
+
+
+@router.callback_query()
 async def on_button_pressed(query_data: CallbackQuery):
     key = _key(query_data)
     match query_data.data.split(':'):
@@ -585,14 +623,14 @@ async def on_button_pressed(query_data: CallbackQuery):
             raise Exception(f)
 
 
-dp.message(StateFilter(FSMStates.SCHEDULE_TEACHER_GENERAL))
+router.message(StateFilter(FSMStates.SCHEDULE_TEACHER_GENERAL))
 
 
 async def find_teacher(message: types.Message):
     """Handler for teacher name input"""
     key = _key(message)
-    filtered = await api.search(message.text,
-                                search_type=api.SearchType.TEACHER)
+    filtered = await local_search.search(message.text,
+                                         search_type=api.SearchType.TEACHER)
     if not filtered:
         msg = await message.answer(
             'Мы не смогли найти ни одного подходящего преподавателя,'
@@ -617,7 +655,7 @@ async def find_teacher(message: types.Message):
         return
 
 
-@dp.message(StateFilter(
+@router.message(StateFilter(
     FSMStates.GROUP_SCHEDULE_GENERAL,
     FSMStates.SCHEDULE_TEACHER_GENERAL
 ))
@@ -625,13 +663,16 @@ async def find_group(message: types.Message):
     """Handler for group name input"""
     key = _key(message)
     state = await dp.storage.get_state(key)
-    # TODO: сохранять результат, делать реальный запрос не чаще, чем раз в 20 секунд
     search_type = api.SearchType.GROUP if (
             state == FSMStates.GROUP_SCHEDULE_GENERAL
     ) else api.SearchType.TEACHER
-    filtered = await api.search(message.text, search_type=search_type)
+    filtered = await local_search.search(message.text,
+                                         search_type=search_type)
     builder = InlineKeyboardBuilder()
-    if not filtered:
+    # Similar labels are offered, never picked: it may be another group.
+    suggested = not filtered and \
+        local_search.suggest(message.text, search_type)
+    if not filtered and not suggested:
         filler = ''
         match search_type:
             case api.SearchType.GROUP:
@@ -647,19 +688,14 @@ async def find_group(message: types.Message):
         await add_to_delete_message(_key(message), msg)
         await delete_user_message(key, message.message_id)
         return
-    if len(filtered) == 1:
+    if len(filtered) == 1 and not suggested:
         entry_type = 'group' if (
                 state == FSMStates.GROUP_SCHEDULE_GENERAL) else 'teacher'
         match entry_type:
             case 'group':
                 entry = await db.get_group(id_=int(filtered[0].get('id')))
             case 'teacher':
-                entity = filtered[0]
-                entry = await db.Teacher.update_or_create(
-                    id=int(entity.get('id')),
-                    name=entity.get('label'),
-                    description=entity.get('description')
-                )
+                entry = await db.Teacher.get(int(filtered[0].get('id')))
             case _:
                 raise Exception('This never must be called. ENTRY TYPE ERR')
         await dp.fsm.storage.update_data(key, {entry_type: entry.id})
@@ -673,24 +709,21 @@ async def find_group(message: types.Message):
         )
         await delete_user_message(key, message.message_id)
         return
-    for entity in filtered:
+    for entity in filtered or suggested:
         match search_type:
             case api.SearchType.GROUP:
-                await db.set_group(int(entity.get('id')), entity.get('label'),
-                                   entity.get('description'))
                 builder.button(text=entity.get('label'),
                                callback_data=f'set_group:{entity.get("id")}')
             case api.SearchType.TEACHER:
-                db_entity = await db.Teacher.update_or_create(
-                    id=int(entity.get('id')),
-                    name=entity.get('label'),
-                    description=entity.get('description')
-                )
-                builder.button(text=db_entity.name,
-                               callback_data=f'set_teacher:{db_entity.id}')
+                builder.button(text=entity.get('label'),
+                               callback_data=f'set_teacher:{entity.get("id")}')
     __add_cancel_button(builder)
     builder.adjust(1)
-    if search_type == api.SearchType.GROUP:
+    if suggested:
+        msg = await message.answer(text='Точных совпадений нет. '
+                                        'Возможно, вы имели в виду:',
+                                   reply_markup=builder.as_markup())
+    elif search_type == api.SearchType.GROUP:
         msg = await message.answer(text='По вашему запросу '
                                         'есть вот такие группы:',
                                    reply_markup=builder.as_markup())
@@ -703,11 +736,13 @@ async def find_group(message: types.Message):
     await delete_user_message(key, message.message_id)
 
 
-@dp.message(StateFilter(FSMStates.CREATE_PROFILE))
+@router.message(StateFilter(FSMStates.CREATE_PROFILE))
 async def create_profile(message: types.Message):
     key = _key(message)
     message_text = message.text
-    groups = await api.search(message_text, api.SearchType.GROUP)
+    groups = await local_search.search(message_text, api.SearchType.GROUP)
+    suggested = not groups and \
+        local_search.suggest(message_text, api.SearchType.GROUP)
     res = None
     if len(groups) == 1:
         group = groups[0]
@@ -717,25 +752,22 @@ async def create_profile(message: types.Message):
         await message.answer(
             text=f'Отлично! По умолчанию будет показываться группа {res[1]}'
         )
-        await db.set_group(group.get('id'), group.get('label'),
-                           group.get('description'))
         await dp.storage.set_state(key, None)
         await delete_previous_messages_markup(key=key)
         msg = await command_start_handler(message)
         await add_to_delete_message(key, msg)
 
-    elif len(groups) > 1:
-        res = groups
+    elif len(groups) > 1 or suggested:
+        res = groups or suggested
         builder = InlineKeyboardBuilder()
         for group in res:
-            await db.set_group(group.get('id'), group.get('label'),
-                               group.get('description'))
             builder.button(text=group.get('label'),
                            callback_data=f'set_group:{group.get("id")}')
         __add_cancel_button(builder)
         builder.adjust(1)
         msg = await message.answer(
-            text='По вашему запросу есть вот такие группы:',
+            text='Точных совпадений нет. Возможно, вы имели в виду:'
+            if suggested else 'По вашему запросу есть вот такие группы:',
             reply_markup=builder.as_markup())
         await delete_previous_messages_markup(key=_key(message))
         await add_to_delete_message(_key(message), msg)
@@ -744,24 +776,138 @@ async def create_profile(message: types.Message):
     await delete_user_message(key, message.message_id)
 
 
-@dp.message()
+@router.message()
 async def echo_handler(message: types.Message):
     msg = await command_start_handler(message)
     await add_to_delete_message(_key(msg), msg)
     await delete_user_message(_key(message), message.message_id)
 
 
-@dp.startup()
-async def startup_bot(dispatcher: Dispatcher, bots: tuple[Bot],
-                      router: Dispatcher, **kwargs):
+def create_app() -> tuple[Dispatcher, Bot]:
+    """Builds dispatcher, bot, redis client and reads settings from env
+    (once). Nothing connects yet: connections are made on startup"""
+    global dp, bot, redis_client, message_store, outbound_limiter, PROFILING
+    if dp is not None:
+        return dp, bot
+    started = time.perf_counter()
+    import redis.asyncio as redis
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.fsm.storage.redis import RedisStorage
+
+    logs.setup()
+    token = os.environ.get('TELEGRAM_TOKEN')
+    if not token:
+        raise Exception('Telegram token not provided,'
+                        ' please add TELEGRAM_TOKEN to env vars.')
+    PROFILING = os.environ.get('PROFILING', '0') == '1'
+    ADMIN_IDS.update(int(id_)
+                     for id_ in os.environ.get('ADMIN_IDS', '').split(',')
+                     if id_.strip())
+
+    redis_client = redis.Redis.from_url(
+        os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
+    metrics.instrument_redis(redis_client)
+    message_store = MessageStore(redis_client)
+    if os.environ.get('SCHEDULE_CACHE_BACKEND', 'memory') == 'redis':
+        api.schedule_cache.backend = cache.RedisBackend(
+            redis_client, encode=lessons.encode, decode=lessons.decode)
+
+    dispatcher = Dispatcher(storage=RedisStorage(redis_client))
+    dispatcher.update.outer_middleware(logs.UpdateLogging())
+    metrics.instrument_router(router)
+    dispatcher.include_router(router)
+
+    # Local Bot API server (or bot_bench.py fake one) instead of
+    # api.telegram.org.
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api_url)) \
+        if (api_url := os.environ.get('TELEGRAM_API_URL')) else None
+    bot = Bot(token, session=session, parse_mode="HTML")
+    outbound_limiter = OutboundLimiter(
+        global_rate=float(os.environ.get('TELEGRAM_GLOBAL_RATE', 30)),
+        chat_rate=float(os.environ.get('TELEGRAM_CHAT_RATE', 1)),
+    )
+    bot.session.middleware(outbound_limiter)
+    metrics.instrument_outbound(outbound_limiter)
+    metrics.instrument_breaker(api.client.breaker)
+    bot.session.middleware(metrics.TelegramMetrics())
+    dp = dispatcher
+    cold_start['create_app'] = time.perf_counter() - started
+    return dp, bot
+
+
+@router.startup()
+async def startup_bot(dispatcher: Dispatcher, bots: tuple[Bot], **kwargs):
     global bot
-    bot = kwargs.get('bot', _bot)
-    log.info('BOT ready and available at ',
-          f'https://t.me/{(await bot.get_me()).username}')
+    started = time.perf_counter()
+    bot = kwargs.get('bot', bot)
+    await api.client.start()
+    metrics.serve()
+    if os.environ.get('DB_MIGRATE', '1') == '1':
+        await db.migrate()
+    await local_search.load()
+    log.info('Schedule cache warmed up with %d weeks',
+             await api.warm_schedule_cache())
+    cleaner.start(bot)
+    if PROFILING:
+        from profiler import profiler
+        profiler.start()
+    if interval := float(os.environ.get('CATALOG_SYNC_INTERVAL', 0)):
+        import sync
+        background_tasks.add(asyncio.create_task(
+            sync.run_periodically(interval, on_synced=local_search.load)
+        ))
+    if os.environ.get('NOTIFY_ENABLED', '0') == '1':
+        background_tasks.add(asyncio.create_task(notifier.run(bot)))
+    if os.environ.get('CHANGES_ENABLED', '0') == '1':
+        import changes
+        background_tasks.add(asyncio.create_task(changes.run(bot)))
+    cold_start['startup'] = time.perf_counter() - started
+    for phase, seconds in cold_start.items():
+        metrics.COLD_START_SECONDS.labels(phase).set(seconds)
+    log.info('Cold start: %s', ', '.join(
+        f'{phase} {seconds:.3f}s' for phase, seconds in cold_start.items()),
+        extra={'cold_start': cold_start})
+    log.info('BOT ready and available at https://t.me/%s',
+             (await bot.get_me()).username)
+
+
+@router.shutdown()
+async def shutdown_bot(**_kwargs):
+    await cleaner.stop()
+    if PROFILING:
+        from profiler import profiler
+        profiler.stop()
+        log.info('Profiler stats: %s', profiler.stats)
+    log.info('Outbound queue stats: %s', outbound_limiter.metrics())
+    for task in background_tasks:
+        task.cancel()
+    log.info('API connections stats: %s', api.client.connection_stats())
+    await api.client.close()
+    await db.close()
+    await redis_client.close()
+
+
+# Handlers above are defined, rest is done by create_app and startup.
+cold_start['import'] = time.perf_counter() - _import_started
 
 
 def main() -> None:
-    dp.run_polling(_bot)
+    create_app()
+    if os.environ.get('BOT_MODE', 'polling') == 'webhook':
+        import webhook
+        webhook.run(
+            dp, bot,
+            host=os.environ.get('WEBHOOK_HOST', '0.0.0.0'),
+            port=int(os.environ.get('WEBHOOK_PORT', 8080)),
+            path=os.environ.get('WEBHOOK_PATH', '/webhook'),
+            webhook_url=os.environ.get('WEBHOOK_URL'),
+            secret_token=os.environ.get('WEBHOOK_SECRET'),
+            max_in_flight=int(os.environ.get('WEBHOOK_MAX_IN_FLIGHT', 100)),
+            max_pending=int(os.environ.get('WEBHOOK_MAX_PENDING', 1000)),
+        )
+    else:
+        dp.run_polling(bot)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,313 @@
+"""Offline end-to-end benchmark of bot handlers.
+
+Runs real ``bot.dp`` against local stand-ins: fake rasp.omgtu.ru (replays
+search results and recorded lessons of main.json), fake Telegram Bot API,
+fakeredis (or local Redis with --redis-url) and a temporary SQLite db.
+Synthetic users go start -> group search -> today -> tomorrow -> week,
+latency of every update is measured. No network is used (fakeredis
+package is needed unless --redis-url is given).
+
+Usage:
+    python bot_bench.py [--users 200] [--concurrency 50] [--rounds 1]
+                        [--groups recorded_groups.json] [--latency 0]
+                        [--max-p95 0.05] [--json]
+"""
+import argparse
+import asyncio
+import copy
+import datetime
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+import lessons
+
+BOT_ID = 123456
+TOKEN = f'{BOT_ID}:bench-token'
+
+
+class FakeRasp:
+    """Serves /api/search and /api/schedule like rasp.omgtu.ru.
+
+    Schedule of any entity and week is recorded lessons re-dated into the
+    requested week (4 lessons per day, monday - saturday).
+    """
+
+    def __init__(self, groups: list[dict], recorded: list[dict],
+                 latency: float = 0):
+        self.groups = groups
+        self.recorded = recorded
+        self.latency = latency
+        self.stats = {'search': 0, 'schedule': 0}
+
+    async def search(self, request: web.Request) -> web.Response:
+        self.stats['search'] += 1
+        await asyncio.sleep(self.latency)
+        term = request.query.get('term', '').lower()
+        return web.json_response([group for group in self.groups
+                                  if term in group['label'].lower()])
+
+    async def schedule(self, request: web.Request) -> web.Response:
+        self.stats['schedule'] += 1
+        await asyncio.sleep(self.latency)
+        start = lessons.as_date(request.query['start'])
+        week = []
+        for day in range(6):
+            date = (start + datetime.timedelta(days=day)).strftime('%Y.%m.%d')
+            for number in range(4):
+                lesson = copy.copy(self.recorded[number % len(self.recorded)])
+                lesson['date'] = date
+                lesson['beginLesson'] = f'{8 + number * 2:02}:00'
+                week.append(lesson)
+        return web.json_response(week)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/api/search', self.search)
+        app.router.add_get('/api/schedule/{type}/{id}', self.schedule)
+        return app
+
+
+class FakeTelegram:
+    """Answers Bot API methods with minimal valid results, remembers last
+    message sent to every chat (to press its buttons)"""
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.last_message: dict[int, dict] = {}
+        self.stats: dict[str, int] = {}
+        self._ids = itertools.count(1_000_000)
+
+    def _message(self, chat_id: int, text: str | None,
+                 message_id: int | None = None) -> dict:
+        return {
+            'message_id': message_id or next(self._ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'bench'},
+            'text': text or '',
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.stats[method] = self.stats.get(method, 0) + 1
+        await asyncio.sleep(self.latency)
+        data = await request.post()
+        result = True
+        if method == 'getMe':
+            result = {'id': BOT_ID, 'is_bot': True, 'first_name': 'bench',
+                      'username': 'bench_bot'}
+        elif method in ('sendMessage', 'editMessageText'):
+            chat_id = int(data['chat_id'])
+            message_id = int(data['message_id']) \
+                if 'message_id' in data else None
+            result = self._message(chat_id, data.get('text'), message_id)
+            self.last_message[chat_id] = result
+        elif method == 'editMessageReplyMarkup':
+            result = self._message(int(data['chat_id']), '',
+                                   int(data['message_id']))
+        return web.json_response({'ok': True, 'result': result})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        return app
+
+
+def synthetic_groups(count: int) -> list[dict]:
+    return [{'id': 1000 + i, 'label': f'ГР-{i:04}',
+             'description': 'Бенчмарк', 'type': 'group'}
+            for i in range(count)]
+
+
+async def serve(app: web.Application) -> tuple[web.AppRunner, int]:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, runner.addresses[0][1]
+
+
+class Driver:
+    """Feeds synthetic updates of users into dispatcher"""
+
+    def __init__(self, bot_module, telegram: FakeTelegram):
+        self.bot_module = bot_module
+        self.telegram = telegram
+        self.latencies: dict[str, list[float]] = {}
+        self.failed = 0
+        self._update_ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+
+    def message(self, user_id: int, text: str) -> dict:
+        update_id = next(self._update_ids)
+        return {'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id), 'text': text,
+        }}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        update_id = next(self._update_ids)
+        message = self.telegram.last_message.get(user_id) or \
+            self.telegram._message(user_id, '')
+        return {'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'from': self._user(user_id),
+            'chat_instance': str(user_id), 'message': message, 'data': data,
+        }}
+
+    async def feed(self, step: str, data: dict):
+        from aiogram import types
+        bot = self.bot_module.bot
+        update = types.Update.model_validate(data, context={'bot': bot})
+        started = time.perf_counter()
+        try:
+            await self.bot_module.dp.feed_update(bot, update)
+        except Exception as exc:
+            self.failed += 1
+            print(f'{step} failed: {exc!r}', file=sys.stderr)
+        self.latencies.setdefault(step, []).append(
+            time.perf_counter() - started)
+
+    async def scenario(self, user_id: int, group: dict):
+        bot = self.bot_module
+        await self.feed('start', self.message(user_id, '/start'))
+        await self.feed('search_menu', self.callback(
+            user_id, bot.FSMStates.GROUP_SCHEDULE_GENERAL))
+        await self.feed('find_group', self.message(user_id, group['label']))
+        await self.feed('today', self.callback(
+            user_id, bot.Callbacks.GROUP_TODAY_SCHEDULE))
+        await self.feed('tomorrow', self.callback(
+            user_id, bot.Callbacks.GROUP_TOMORROW_SCHEDULE))
+        await self.feed('week_menu', self.callback(
+            user_id, bot.Callbacks.GROUP_WEEK_SCHEDULE))
+        await self.feed('week', self.callback(
+            user_id, bot.FSMStates.SCHEDULE_WEEK_CURRENT))
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    if len(values) < 2:
+        values = values * 2 or [0.0, 0.0]
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return {'p50': cuts[49], 'p95': cuts[94], 'p99': cuts[98],
+            'max': max(values)}
+
+
+async def main(args: argparse.Namespace) -> dict:
+    if args.groups:
+        with open(args.groups, encoding='utf-8') as f:
+            groups = json.load(f)
+    else:
+        groups = synthetic_groups(args.users)
+    with open('main.json', encoding='utf-8') as f:
+        recorded = json.load(f)
+    rasp = FakeRasp(groups, recorded, args.latency / 1000)
+    telegram = FakeTelegram(args.latency / 1000)
+    rasp_runner, rasp_port = await serve(rasp.app())
+    telegram_runner, telegram_port = await serve(telegram.app())
+    workdir = tempfile.mkdtemp(prefix='rasp_bench_')
+    os.environ.update({
+        'TELEGRAM_TOKEN': TOKEN,
+        'TELEGRAM_API_URL': f'http://127.0.0.1:{telegram_port}',
+        'RASP_URL': f'http://127.0.0.1:{rasp_port}/',
+        'DB_URL': f'sqlite+aiosqlite:///{workdir}/bench.sqlite3',
+        'LOG_PATH': workdir,
+        'METRICS_PORT': '0',
+        'NOTIFY_ENABLED': '0',
+        'CHANGES_ENABLED': '0',
+        'CATALOG_SYNC_INTERVAL': '0',
+    })
+    # Measure our code, not flood limits (set them to check limiter).
+    os.environ.setdefault('TELEGRAM_GLOBAL_RATE', '1000000')
+    os.environ.setdefault('TELEGRAM_CHAT_RATE', '1000000')
+    if args.redis_url:
+        os.environ['REDIS_URL'] = args.redis_url
+    else:
+        import fakeredis.aioredis
+        import redis.asyncio
+        fake_redis = fakeredis.aioredis.FakeRedis()
+        redis.asyncio.Redis.from_url = lambda *_args, **_kwargs: fake_redis
+    import bot as bot_module
+
+    dp, bot = bot_module.create_app()
+    await dp.emit_startup(dispatcher=dp, bots=(bot,), bot=bot)
+    driver = Driver(bot_module, telegram)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def user(index: int):
+        async with semaphore:
+            await driver.scenario(index + 1, groups[index % len(groups)])
+
+    started = time.perf_counter()
+    for _round in range(args.rounds):
+        await asyncio.gather(*(user(i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+    await dp.emit_shutdown(dispatcher=dp, bots=(bot,), bot=bot)
+    await bot.session.close()
+    await rasp_runner.cleanup()
+    await telegram_runner.cleanup()
+
+    all_latencies = [value for values in driver.latencies.values()
+                     for value in values]
+    return {
+        'updates': len(all_latencies),
+        'failed': driver.failed,
+        'elapsed': round(elapsed, 3),
+        'updates_per_second': round(len(all_latencies) / elapsed, 1),
+        'latency': {k: round(v, 5)
+                    for k, v in percentiles(all_latencies).items()},
+        'steps': {step: {k: round(v, 5)
+                         for k, v in percentiles(values).items()}
+                  for step, values in driver.latencies.items()},
+        'upstream': rasp.stats,
+        'telegram': telegram.stats,
+    }
+
+
+def print_report(report: dict):
+    print(f'{report["updates"]} updates ({report["failed"]} failed) in '
+          f'{report["elapsed"]}s: {report["updates_per_second"]} updates/s')
+    print(f'{"step":<12}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+          f'{"max ms":>10}')
+    for step, values in [*report['steps'].items(),
+                         ('all', report['latency'])]:
+        print(f'{step:<12}' + ''.join(f'{values[k] * 1000:>10.2f}'
+                                      for k in ('p50', 'p95', 'p99', 'max')))
+    print(f'upstream requests: {report["upstream"]}')
+    print(f'telegram requests: {report["telegram"]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=1,
+                        help='times every user goes through scenario')
+    parser.add_argument('--groups',
+                        help='recorded /api/search response (json list)')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='ms added to every fake upstream/Telegram call')
+    parser.add_argument('--redis-url',
+                        help='local Redis instead of fakeredis')
+    parser.add_argument('--max-p95', type=float,
+                        help='exit with code 1 if p95 (s) is higher')
+    parser.add_argument('--json', action='store_true',
+                        help='print report as json (to compare runs)')
+    args = parser.parse_args()
+    report = asyncio.run(main(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    too_slow = args.max_p95 is not None and \
+        report['latency']['p95'] > args.max_p95
+    if report['failed'] or too_slow:
+        sys.exit(1)
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+
+class MemoryBackend:
+    """In-process LRU storage. Bounded by items count and, if ``sizeof``
+    (approx. bytes of value) is given, by bytes"""
+
+    def __init__(self, max_items: int = 5000,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 sizeof: Callable[[Any], int] | None = None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.size = 0
+        self._data: OrderedDict[str, tuple[Any, float, float, int]] = \
+            OrderedDict()
+
+    async def get(self, key: str) -> tuple[Any, float] | None:
+        """Returns (value, stored_at) or None if not found/expired"""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, stored_at, expires_at, _size = item
+        if expires_at < time.time():
+            self._pop(key)
+            return None
+        self._data.move_to_end(key)
+        return value, stored_at
+
+    async def set(self, key: str, value: Any, ttl: float,
+                  stored_at: float | None = None):
+        """``ttl`` counts from ``stored_at`` (now by default)"""
+        stored_at = stored_at or time.time()
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        if size > self.max_bytes:
+            return
+        self._pop(key)
+        self._data[key] = (value, stored_at, stored_at + ttl, size)
+        self.size += size
+        while len(self._data) > self.max_items or self.size > self.max_bytes:
+            self._pop(next(iter(self._data)))
+
+    async def delete(self, key: str):
+        self._pop(key)
+
+    def _pop(self, key: str):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.size -= item[3]
+
+
+class RedisBackend:
+    """Shared storage, so all bot replicas use same cache.
+
+    Memory bound and eviction are up to redis (maxmemory-policy).
+    Values are stored as json, ``encode``/``decode`` convert them to
+    json-compatible form and back.
+    """
+
+    def __init__(self, redis, prefix: str = 'rasp_cache:',
+                 encode: Callable[[Any], Any] = None,
+                 decode: Callable[[Any], Any] = None):
+        self.redis = redis
+        self.prefix = prefix
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda value: value)
+
+    async def get(self, key: str) -> tuple[Any, float] | None:
+        raw = await self.redis.get(self.prefix + key)
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        return self.decode(data['v']), data['t']
+
+    async def set(self, key: str, value: Any, ttl: float,
+                  stored_at: float | None = None):
+        """``ttl`` counts from ``stored_at`` (now by default)"""
+        now = time.time()
+        stored_at = stored_at or now
+        await self.redis.set(
+            self.prefix + key,
+            json.dumps({'v': self.encode(value), 't': stored_at},
+                       ensure_ascii=False, default=str),
+            ex=max(int(stored_at + ttl - now), 1)
+        )
+
+    async def delete(self, key: str):
+        await self.redis.delete(self.prefix + key)
+
+
+class SingleFlight:
+    """Deduplicates concurrent identical calls.
+
+    While call with some key is in flight, other callers with same key
+    don't start their own, but wait for result of first one.
+    """
+
+    def __init__(self):
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self.stats = {'calls': 0, 'coalesced': 0}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        self.stats['calls'] += 1
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.stats['coalesced'] += 1
+        else:
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _t: self._in_flight.pop(key, None))
+        # shield: cancellation of one caller must not cancel others.
+        return await asyncio.shield(task)
+
+
+class TTLCache:
+    """Cache with TTL and stale-while-revalidate.
+
+    Fresh value (younger than ``ttl``) is returned as is. Stale value
+    (younger than ``ttl + stale_ttl``) is returned too, but refresh is
+    started in background. Otherwise value is fetched and awaited.
+
+    On miss ``fallback`` (persistent store) is asked first: its value is
+    served as cached one if it's not older than ``ttl + stale_ttl``, and
+    any its value is served if fetch fails. Concurrent misses of a key
+    share one load (one fallback read, one fetch, one save).
+    """
+
+    def __init__(self, backend=None, ttl: float = 600,
+                 stale_ttl: float = 3600):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.stats = {'hits': 0, 'stale_hits': 0, 'misses': 0,
+                      'fallbacks': 0}
+        self._refreshing: dict[str, asyncio.Task] = {}
+        self._loading = SingleFlight()
+
+    async def get_or_fetch(
+            self, key: str, fetch: Callable[[], Awaitable[Any]],
+            fallback: Callable[[], Awaitable[tuple[Any, float] | None]] = None
+    ) -> Any:
+        cached = await self.backend.get(key)
+        if cached is not None:
+            value, stored_at = cached
+            if time.time() - stored_at <= self.ttl:
+                self.stats['hits'] += 1
+                return value
+            self.stats['stale_hits'] += 1
+            self._refresh_in_background(key, fetch)
+            return value
+        self.stats['misses'] += 1
+        return await self._loading.do(
+            key, lambda: self._load(key, fetch, fallback))
+
+    async def _load(
+            self, key: str, fetch: Callable[[], Awaitable[Any]],
+            fallback: Callable[[], Awaitable[tuple[Any, float] | None]] = None
+    ) -> Any:
+        stored = await fallback() if fallback is not None else None
+        if stored is not None:
+            value, stored_at = stored
+            age = time.time() - stored_at
+            if age <= self.ttl + self.stale_ttl:
+                self.stats['fallbacks'] += 1
+                await self.set(key, value, stored_at)
+                if age > self.ttl:
+                    self._refresh_in_background(key, fetch)
+                return value
+        value = await self._fetch(key, fetch)
+        if value is None and stored is not None:
+            self.stats['fallbacks'] += 1
+            return stored[0]
+        return value
+
+    async def set(self, key: str, value: Any, stored_at: float | None = None):
+        await self.backend.set(key, value, self.ttl + self.stale_ttl,
+                               stored_at)
+
+    async def contains(self, key: str) -> bool:
+        return await self.backend.get(key) is not None
+
+    async def delete(self, key: str):
+        await self.backend.delete(key)
+
+    async def _fetch(self, key: str, fetch: Callable[[], Awaitable[Any]]):
+        value = await fetch()
+        if value is not None:  # None means upstream error, don't cache it.
+            await self.set(key, value)
+        return value
+
+    def _refresh_in_background(self, key: str,
+                               fetch: Callable[[], Awaitable[Any]]):
+        if key in self._refreshing:
+            return
+        task = asyncio.create_task(self._fetch(key, fetch))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _t: self._refreshing.pop(key, None))
+
+
+class LRUCache:
+    """Small sync LRU for hot objects (db rows). Has hit/miss counters.
+    Items expire after ``ttl`` seconds (if given)"""
+
+    def __init__(self, max_items: int = 10000, ttl: float | None = None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0}
+        self._data: OrderedDict[Any, tuple[Any, float]] = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is not None and item[1] >= time.monotonic():
+            self.stats['hits'] += 1
+            self._data.move_to_end(key)
+            return item[0]
+        if item is not None:
+            del self._data[key]
+        self.stats['misses'] += 1
+        return default
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl \
+            if self.ttl is not None else float('inf')
+        self._data[key] = value, expires_at
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_items:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
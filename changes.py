@@ -0,0 +1,191 @@
+"""Schedule change notifications.
+
+Poller refetches current and next week of every group somebody is
+subscribed to, hashes content of every day and compares it with the day
+subscribers were last notified about (``db.ScheduleSnapshot``). When a
+day changes, subscribers of group get the diff of it.
+
+Poll is kept cheap: upstream requests are conditional (if upstream gives
+ETag/Last-Modified) and week whose hash didn't change since last poll is
+not compared with the db at all.
+"""
+import asyncio
+import collections
+import datetime
+import hashlib
+import json
+import logging
+import os
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+
+import api
+import db
+from lessons import Lesson
+from notifier import TIMEZONE
+from render import render_lesson
+
+log = logging.getLogger(__name__)
+
+POLL_INTERVAL = int(os.environ.get('CHANGES_POLL_INTERVAL', 1800))
+
+# (group id, week start): validators of upstream response / week hash.
+_validators: dict[tuple[int, datetime.date], dict[str, str]] = {}
+_week_digests: dict[tuple[int, datetime.date], str] = {}
+
+
+def digest(lessons: list[list]) -> str:
+    return hashlib.blake2b(json.dumps(lessons, ensure_ascii=False).encode(),
+                           digest_size=16).hexdigest()
+
+
+def _order(item: list) -> tuple:
+    return tuple(value or '' for value in item)
+
+
+def split_days(lessons: list[Lesson], since: datetime.date
+               ) -> dict[datetime.date, list[list]]:
+    """Encoded lessons by day (sorted, so digest doesn't depend on order
+    of upstream response), past days are skipped"""
+    days: dict[datetime.date, list[list]] = {}
+    for lesson in lessons:
+        if lesson.date >= since:
+            days.setdefault(lesson.date, []).append(lesson.as_list())
+    for day in days.values():
+        day.sort(key=_order)
+    return days
+
+
+def diff_day(old: list[list], new: list[list]
+             ) -> list[tuple[str, Lesson | None, Lesson | None]]:
+    """('added'|'removed'|'changed', old lesson, new lesson) sorted by
+    begin time.
+
+    Days are compared as multisets of whole lessons: subgroups have
+    parallel lessons at the same time. Removed and added lesson are shown
+    as one changed only if each is the only one at its time.
+    """
+    old_count = collections.Counter(map(tuple, old))
+    new_count = collections.Counter(map(tuple, new))
+    removed = sorted((old_count - new_count).elements(), key=_order)
+    added = sorted((new_count - old_count).elements(), key=_order)
+    by_time: dict[str | None, tuple[list, list]] = {}
+    for item in removed:
+        by_time.setdefault(item[1], ([], []))[0].append(item)
+    for item in added:
+        by_time.setdefault(item[1], ([], []))[1].append(item)
+    res = []
+    for begin in sorted(by_time, key=lambda value: value or ''):
+        before, after = by_time[begin]
+        if len(before) == 1 and len(after) == 1:
+            res.append(('changed', Lesson.from_list(before[0]),
+                        Lesson.from_list(after[0])))
+            continue
+        res += [('removed', Lesson.from_list(item), None) for item in before]
+        res += [('added', None, Lesson.from_list(item)) for item in after]
+    return res
+
+
+def render_changes(label: str | int,
+                   days: dict[datetime.date, list[tuple]]) -> str:
+    res = f'Изменения в расписании группы <b>{label}</b>\n\n'
+    for date, changes in sorted(days.items()):
+        res += f'{date:%d.%m.%Y}\n'
+        for kind, before, after in changes:
+            if kind == 'added':
+                res += '➕' + render_lesson(after)
+            elif kind == 'removed':
+                res += '➖' + render_lesson(before)
+            else:
+                res += '✏' + render_lesson(after)
+        res += '\n'
+    return res
+
+
+async def check_group(group_id: int, today: datetime.date
+                      ) -> dict[datetime.date, list[tuple]]:
+    """Changed days of group (compared with snapshots, which get updated).
+
+    Days seen for the first time are just remembered.
+    """
+    weeks = []
+    for week_start in (today - datetime.timedelta(days=today.weekday()),
+                       today + datetime.timedelta(days=7 - today.weekday())):
+        key = (group_id, week_start)
+        lessons, _validators[key] = await api.refresh_week(
+            group_id, api.SearchType.GROUP, week_start, _validators.get(key))
+        if lessons is None:  # Not modified or upstream error.
+            continue
+        days = split_days(lessons, today)
+        week_digest = digest([[str(date), day]
+                              for date, day in sorted(days.items())])
+        if _week_digests.get(key) == week_digest:
+            continue
+        _week_digests[key] = week_digest
+        weeks.append((week_start, days))
+    changed = {}
+    for week_start, days in weeks:
+        dates = [week_start + datetime.timedelta(days=i) for i in range(7)]
+        dates = [date for date in dates if date >= today]
+        snapshots = await db.ScheduleSnapshot.get_many(
+            api.SearchType.GROUP, group_id, dates)
+        updates = []
+        for date in dates:
+            day = days.get(date, [])
+            day_digest = digest(day)
+            snapshot = snapshots.get(date)
+            if snapshot is not None and snapshot.digest == day_digest:
+                continue
+            if snapshot is not None:
+                if changes := diff_day(snapshot.lessons, day):
+                    changed[date] = changes
+                else:  # Digest is of same sorted lessons, unexpected.
+                    log.warning('Digest of %s %s changed without lesson '
+                                'changes', group_id, date)
+            elif not day:  # Nothing to remember.
+                continue
+            updates.append({'search_type': api.SearchType.GROUP,
+                            'entity_id': group_id, 'date': date,
+                            'digest': day_digest, 'lessons': day})
+        await db.ScheduleSnapshot.save_many(updates)
+    return changed
+
+
+async def poll(bot: Bot, concurrency: int = 10) -> dict[str, int]:
+    today = datetime.datetime.now(TIMEZONE).date()
+    groups = await db.get_subscribed_groups()
+    semaphore = asyncio.Semaphore(concurrency)
+    report = {'groups': len(groups), 'changed': 0, 'delivered': 0}
+
+    async def process(group_id: int, chats: list[int]):
+        async with semaphore:
+            changed = await check_group(group_id, today)
+        if not changed:
+            return
+        report['changed'] += 1
+        group = await db.get_group(group_id)
+        text = render_changes(group.label if group else group_id, changed)
+        for chat_id in chats:
+            try:
+                await bot.send_message(chat_id, text)
+                report['delivered'] += 1
+            except TelegramForbiddenError:  # Bot was blocked by user.
+                await db.set_subscription(chat_id, None)
+            except TelegramAPIError as exc:
+                log.warning('Change notification to %s failed: %s',
+                            chat_id, exc)
+
+    await asyncio.gather(*(process(group_id, chats)
+                           for group_id, chats in groups.items()))
+    return report
+
+
+async def run(bot: Bot, interval: float = POLL_INTERVAL):
+    """Background task polling for changes every ``interval`` seconds"""
+    while True:
+        try:
+            log.info('Schedule changes: %s', await poll(bot))
+        except Exception as exc:
+            log.exception('Schedule changes poll failed: %s', exc)
+        await asyncio.sleep(interval)
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+log = logging.getLogger(__name__)
+
+# Bot API limit of deleteMessages.
+BULK_DELETE_LIMIT = 100
+
+
+async def delete_messages(bot: Bot, chat_id: int, message_ids: list[int],
+                          concurrency: int = 10):
+    """Deletes messages by bulk ``deleteMessages`` if bot supports it,
+    otherwise one by one, but concurrently. Errors are ignored: message may
+    be already deleted or too old."""
+    if not message_ids:
+        return
+    if hasattr(bot, 'delete_messages'):
+        for i in range(0, len(message_ids), BULK_DELETE_LIMIT):
+            try:
+                await bot.delete_messages(
+                    chat_id, message_ids[i:i + BULK_DELETE_LIMIT])
+            except TelegramAPIError:
+                pass
+        return
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def delete(message_id: int):
+        async with semaphore:
+            try:
+                await bot.delete_message(chat_id, message_id)
+            except TelegramAPIError:
+                pass
+
+    await asyncio.gather(*(delete(message_id) for message_id in message_ids))
+
+
+class MessageCleaner:
+    """Background queue of deletions, so user doesn't wait for them"""
+
+    def __init__(self, concurrency: int = 10):
+        self.concurrency = concurrency
+        self.queue: asyncio.Queue[tuple[int, list[int]]] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    def delete(self, chat_id: int, message_ids: list[int]):
+        if message_ids:
+            self.queue.put_nowait((chat_id, list(message_ids)))
+
+    def start(self, bot: Bot):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self, timeout: float = 5):
+        """Waits (up to timeout) for queued deletions, then stops worker"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning('%d cleanup jobs dropped', self.queue.qsize())
+        self._task.cancel()
+        self._task = None
+
+    async def _run(self, bot: Bot):
+        while True:
+            chat_id, message_ids = await self.queue.get()
+            try:
+                await delete_messages(bot, chat_id, message_ids,
+                                      self.concurrency)
+            except Exception as exc:
+                log.exception('Cleanup of chat %s failed: %s', chat_id, exc)
+            finally:
+                self.queue.task_done()
+
+
+cleaner = MessageCleaner()
@@ -1,23 +1,196 @@
 # TODO: ПЕРЕПИСАТЬ ВЕСЬ ФАЙЛ. занести связанные функции Group и User в классы
 #  (инкапсулировать как в Teacher)
 import asyncio
+import datetime
+import os
 from typing import Self
 
 from sqlalchemy.orm import DeclarativeBase, Mapped
 from sqlalchemy.orm import mapped_column
 from sqlalchemy.orm import MappedAsDataclass
 from sqlalchemy.ext.asyncio import create_async_engine as create_engine,\
-    async_sessionmaker
-from sqlalchemy import insert, select, update, Row
+    async_sessionmaker, AsyncEngine
+from sqlalchemy import event, func, insert, inspect, select, text, update, \
+    Row, JSON
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import cache
+
+# SQLite or PostgreSQL (upserts use ON CONFLICT). Read from env when
+# engines are created (on first query), not on import.
+DEFAULT_DB_URL = 'sqlite+aiosqlite:///db.sqlite3'
+READ_POOL_SIZE = int(os.environ.get('DB_READ_POOL_SIZE', 5))
+# Applied by PRAGMA on every new connection.
+SQLITE_PROFILE = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 128 * 1024 * 1024)),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -32000)),  # KiB
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),  # ms
+    'temp_store': 'MEMORY',
+}
+INDEXES = (
+    # user_account.chat_id is covered by its UNIQUE constraint autoindex.
+    'CREATE INDEX IF NOT EXISTS ix_user_account_group_id '
+    'ON user_account (group_id)',
+    'CREATE INDEX IF NOT EXISTS ix_user_account_notify_time '
+    'ON user_account (notify_time)',
+)
+
+
+def create_sqlite_engine(url: str, profile: dict | None = None,
+                         pool_size: int = 1, read_only: bool = False):
+    engine = create_engine(url, poolclass=AsyncAdaptedQueuePool,
+                           pool_size=pool_size, max_overflow=0)
+
+    @event.listens_for(engine.sync_engine, 'connect')
+    def _on_connect(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in (profile or {}).items():
+            cursor.execute(f'PRAGMA {pragma}={value}')
+        if read_only:
+            cursor.execute('PRAGMA query_only=ON')
+        cursor.close()
+
+    return engine
+
+
+_engines: dict[str, AsyncEngine] = {}
+_sessionmakers: dict[str, async_sessionmaker] = {}
+
+
+def init(url: str | None = None):
+    """Creates engines. Called on first query, or explicitly to use
+    another db"""
+    import metrics
+
+    url = url or os.environ.get('DB_URL', DEFAULT_DB_URL)
+    if url.startswith('sqlite'):
+        # Writes go through one connection (SQLite has one writer anyway,
+        # so it's better to queue here than to wait for lock), reads use
+        # own pool.
+        engine = create_sqlite_engine(url, SQLITE_PROFILE, pool_size=1)
+        read_engine = create_sqlite_engine(url, SQLITE_PROFILE,
+                                           pool_size=READ_POOL_SIZE,
+                                           read_only=True)
+    else:
+        engine = read_engine = create_engine(url, pool_size=READ_POOL_SIZE)
+    for instrumented in {engine, read_engine}:
+        metrics.instrument_engine(instrumented.sync_engine)
+    _engines.update(write=engine, read=read_engine)
+    _sessionmakers.update(
+        write=async_sessionmaker(engine, expire_on_commit=False),
+        read=async_sessionmaker(read_engine, expire_on_commit=False),
+    )
+
+
+async def close():
+    for engine in set(_engines.values()):
+        await engine.dispose()
+    _engines.clear()
+    _sessionmakers.clear()
+
+
+def _engine(read_only: bool = False) -> AsyncEngine:
+    if not _engines:
+        init()
+    return _engines['read' if read_only else 'write']
+
+
+def _session() -> async_sessionmaker:
+    if not _sessionmakers:
+        init()
+    return _sessionmakers['write']
+
+
+def _read_session() -> async_sessionmaker:
+    if not _sessionmakers:
+        init()
+    return _sessionmakers['read']
+
+
+def _insert(model):
+    if _engine().dialect.name == 'sqlite':
+        return sqlite_insert(model)
+    return postgresql_insert(model)
+
+# Read-through caches of rarely changed rows. Writes below keep them
+# up to date in this process; rows written by other processes (runner
+# workers, sync.py) are seen after ``DB_CACHE_TTL`` seconds. Misses are
+# not cached: row may be inserted by another process.
+CACHE_TTL = float(os.environ.get('DB_CACHE_TTL', 60))
+profile_cache = cache.LRUCache(
+    int(os.environ.get('PROFILE_CACHE_SIZE', 10000)), CACHE_TTL)
+group_cache = cache.LRUCache(
+    int(os.environ.get('GROUP_CACHE_SIZE', 5000)), CACHE_TTL)
+teacher_cache = cache.LRUCache(
+    int(os.environ.get('TEACHER_CACHE_SIZE', 5000)), CACHE_TTL)
 
-__engine = create_engine("sqlite+aiosqlite:///db.sqlite3")
-_session = async_sessionmaker(__engine, expire_on_commit=False)
 
 class Base(MappedAsDataclass, DeclarativeBase):
     """subclasses will be converted to dataclasses"""
     pass
 
 
+def _upsert(model, values: dict, index: str = 'id',
+            keep_existing: bool = True):
+    """Single ``INSERT ... ON CONFLICT DO UPDATE`` statement.
+
+    If ``keep_existing``, empty values don't overwrite existing ones.
+    """
+    stmt = _insert(model).values(**values)
+    fields = [field for field in values if field != index]
+    return stmt.on_conflict_do_update(
+        index_elements=[index],
+        set_={
+            field: func.coalesce(func.nullif(stmt.excluded[field], ''),
+                                 getattr(model, field))
+            if keep_existing else stmt.excluded[field]
+            for field in fields
+        }
+    )
+
+
+async def _bulk_upsert(session, model, rows: list[dict],
+                       fields: tuple[str, ...]) -> tuple[int, int]:
+    """Inserts new and updates changed rows by one executemany.
+
+    Empty values don't overwrite existing ones. Returns (added, changed).
+    """
+    columns = [getattr(model, field) for field in fields]
+    query = select(model.id, *columns)
+    if len(rows) <= 500:  # else whole table is cheaper than huge IN (...).
+        query = query.where(model.id.in_([int(row['id']) for row in rows]))
+    existing = {row[0]: row for row in (await session.execute(query)).all()}
+    to_write, added, changed = {}, 0, 0
+    for row in rows:
+        id_ = int(row['id'])
+        old = existing.get(id_)
+        values = {
+            field: row.get(field) or (old[i + 1] if old else None)
+            for i, field in enumerate(fields)
+        }
+        if old is None:
+            added += 1
+        elif tuple(values.values()) != tuple(old[1:]):
+            changed += 1
+        else:
+            continue
+        to_write[id_] = {'id': id_, **values}
+    if to_write:
+        stmt = _insert(model)
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=['id'],
+                set_={field: stmt.excluded[field] for field in fields}
+            ),
+            list(to_write.values())
+        )
+    return added, changed
+
+
 class Group(Base):
     __tablename__ = "group"
     id: Mapped[int] = mapped_column(init=True, primary_key=True, unique=True)
@@ -29,8 +202,15 @@ class User(Base):
     __tablename__ = "user_account"
     id: Mapped[int] = mapped_column(init=False, primary_key=True)
     chat_id: Mapped[int] = mapped_column(init=False, unique=True)
-    group_id: Mapped[int] = mapped_column(nullable=False, default=546)
+    group_id: Mapped[int] = mapped_column(nullable=False, default=546,
+                                          index=True)
     username: Mapped[str] = mapped_column(nullable=True, init=False)
+    # Daily schedule notification: time 'HH:MM' (None if not subscribed)
+    # and days of week bitmask (bit 0 is monday).
+    notify_time: Mapped[str] = mapped_column(nullable=True, init=False,
+                                             default=None, index=True)
+    notify_days: Mapped[int] = mapped_column(nullable=True, init=False,
+                                             default=None)
 
 
 class Teacher(Base):
@@ -42,30 +222,47 @@ class Teacher(Base):
     @classmethod
     async def update_or_create(cls, **kwargs) -> Self:
         """Updates row with provided id. If id not found, creates new row"""
-        async with _session.begin() as session:
-            teacher = await cls.get(kwargs.get('id'))
-            if not teacher:
-                return (await session.execute(insert(Teacher).returning(Teacher), kwargs)).first()[0]
-            else:
-                return (await session.execute(
-                    update(Teacher).where(Teacher.id == teacher.id).values(
-                        name=kwargs.get('name') or teacher.name,
-                        description=kwargs.get('description') or teacher.description
-                    ).returning(Teacher)
-                )).first()[0]
+        async with _session().begin() as session:
+            teacher = (await session.execute(_upsert(Teacher, {
+                'id': kwargs.get('id'),
+                'name': kwargs.get('name'),
+                'description': kwargs.get('description')
+            }).returning(Teacher))).first()[0]
+        teacher_cache.set(teacher.id, teacher)
+        return teacher
 
     @classmethod
     async def get(cls, value, field='id') -> Self:
-        """Get one by id (or any field)"""
-        async with _session.begin() as session:
+        """Get one by id (or any field). By id is cached"""
+        if field == 'id' and \
+                (res := teacher_cache.get(int(value))) is not None:
+            return res
+        async with _read_session().begin() as session:
             res = (await
                 session.execute(
                     select(Teacher).filter_by(**{field: value})
                 )
             ).first()
-            if not res:
-                return None
-            return res[0]
+            res = res[0] if res else None
+        if field == 'id' and res is not None:
+            teacher_cache.set(int(value), res)
+        return res
+
+    @classmethod
+    async def bulk_upsert(cls, teachers: list[dict]) -> tuple[int, int]:
+        """Upserts many teachers (dicts with id, name, description)
+        in one transaction. Returns (added, changed)"""
+        async with _session().begin() as session:
+            res = await _bulk_upsert(session, Teacher, teachers,
+                                     ('name', 'description'))
+        for teacher in teachers:
+            teacher_cache.delete(int(teacher['id']))
+        return res
+
+    @classmethod
+    async def all(cls) -> list[Self]:
+        async with _read_session().begin() as session:
+            return list((await session.execute(select(Teacher))).scalars())
 
     @property
     def label(self):
@@ -75,77 +272,268 @@ class Teacher(Base):
     def label(self, value):
         self.name = value
 
+class ScheduleWeek(Base):
+    """Last known (json-encoded) schedule of entity for week"""
+    __tablename__ = 'schedule_week'
+    search_type: Mapped[str] = mapped_column(primary_key=True)
+    entity_id: Mapped[int] = mapped_column(primary_key=True)
+    week_start: Mapped[datetime.date] = mapped_column(primary_key=True)
+    lessons: Mapped[list] = mapped_column(JSON, nullable=False)
+    fetched_at: Mapped[float] = mapped_column(nullable=False)
+
+    @classmethod
+    async def save(cls, search_type: str, entity_id: int,
+                   week_start: datetime.date, lessons: list,
+                   fetched_at: float):
+        async with _session().begin() as session:
+            stmt = _insert(ScheduleWeek).values(
+                search_type=search_type, entity_id=entity_id,
+                week_start=week_start, lessons=lessons, fetched_at=fetched_at
+            )
+            await session.execute(stmt.on_conflict_do_update(
+                index_elements=['search_type', 'entity_id', 'week_start'],
+                set_={'lessons': stmt.excluded.lessons,
+                      'fetched_at': stmt.excluded.fetched_at}
+            ))
+
+    @classmethod
+    async def get(cls, search_type: str, entity_id: int,
+                  week_start: datetime.date) -> Self | None:
+        async with _read_session().begin() as session:
+            return await session.get(
+                ScheduleWeek, (search_type, entity_id, week_start))
+
+    @classmethod
+    async def since(cls, week_start: datetime.date,
+                    limit: int = 5000) -> list[Self]:
+        """Most recently fetched weeks starting from week_start"""
+        async with _read_session().begin() as session:
+            return list((await session.execute(
+                select(ScheduleWeek)
+                .where(ScheduleWeek.week_start >= week_start)
+                .order_by(ScheduleWeek.fetched_at.desc())
+                .limit(limit)
+            )).scalars())
+
+
+class ScheduleSnapshot(Base):
+    """Day of schedule users were last notified about (for change
+    detection). ``digest`` is hash of ``lessons``"""
+    __tablename__ = 'schedule_snapshot'
+    search_type: Mapped[str] = mapped_column(primary_key=True)
+    entity_id: Mapped[int] = mapped_column(primary_key=True)
+    date: Mapped[datetime.date] = mapped_column(primary_key=True)
+    digest: Mapped[str] = mapped_column(nullable=False)
+    lessons: Mapped[list] = mapped_column(JSON, nullable=False)
+
+    @classmethod
+    async def get_many(cls, search_type: str, entity_id: int,
+                       dates: list[datetime.date]) -> dict[datetime.date,
+                                                           Self]:
+        async with _read_session().begin() as session:
+            return {snapshot.date: snapshot for snapshot in (
+                await session.execute(select(ScheduleSnapshot).where(
+                    ScheduleSnapshot.search_type == search_type,
+                    ScheduleSnapshot.entity_id == entity_id,
+                    ScheduleSnapshot.date.in_(dates)
+                ))
+            ).scalars()}
+
+    @classmethod
+    async def save_many(cls, snapshots: list[dict]):
+        if not snapshots:
+            return
+        async with _session().begin() as session:
+            stmt = _insert(ScheduleSnapshot)
+            await session.execute(stmt.on_conflict_do_update(
+                index_elements=['search_type', 'entity_id', 'date'],
+                set_={'digest': stmt.excluded.digest,
+                      'lessons': stmt.excluded.lessons}
+            ), snapshots)
+
+
+class CatalogSync(Base):
+    """When whole catalog of entity type was last loaded from upstream"""
+    __tablename__ = 'catalog_sync'
+    search_type: Mapped[str] = mapped_column(primary_key=True)
+    synced_at: Mapped[float] = mapped_column(nullable=False)
+
+    @classmethod
+    async def mark(cls, search_type: str, synced_at: float):
+        async with _session().begin() as session:
+            stmt = _insert(CatalogSync).values(search_type=search_type,
+                                               synced_at=synced_at)
+            await session.execute(stmt.on_conflict_do_update(
+                index_elements=['search_type'],
+                set_={'synced_at': stmt.excluded.synced_at}
+            ))
+
+    @classmethod
+    async def all(cls) -> dict[str, float]:
+        async with _read_session().begin() as session:
+            return dict((await session.execute(
+                select(CatalogSync.search_type, CatalogSync.synced_at)
+            )).all())
+
+
 async def get_group(id_: int) -> Group | None:
     # TODO: Incapsulate into model.
-    async with _session.begin() as session:
+    if (res := group_cache.get(int(id_))) is not None:
+        return res
+    async with _read_session().begin() as session:
         res = (await session.execute(select(Group).filter_by(id=id_))).first()
-        if not res:
-            return
-        return res[0]
+    res = res[0] if res else None
+    if res is not None:
+        group_cache.set(int(id_), res)
+    return res
+
+
+async def get_groups() -> list[Group]:
+    async with _read_session().begin() as session:
+        return list((await session.execute(select(Group))).scalars())
+
+
+async def set_groups(groups: list[dict]) -> tuple[int, int]:
+    """Upserts many groups (dicts with id, label, description)
+    in one transaction. Returns (added, changed)"""
+    async with _session().begin() as session:
+        res = await _bulk_upsert(session, Group, groups,
+                                 ('label', 'description'))
+    for group in groups:
+        group_cache.delete(int(group['id']))
+    return res
 
 
 async def set_group(id_: int, label: str, description: str = None):
-    async with _session.begin() as session:
-        group = await get_group(id_)
-        if not group:
-            return await session.execute(insert(Group), {
-                'id': id_,
-                'label': label,
-                'description': description
-            })
-        return await session.execute(
-            update(Group).where(Group.id == id_).values(
-                label=label or group.label,
-                description=description or group.description
-            )
-        )
+    async with _session().begin() as session:
+        res = await session.execute(_upsert(Group, {
+            'id': id_,
+            'label': label,
+            'description': description
+        }))
+    group_cache.delete(int(id_))
+    return res
 
 
 async def set_profile(chat_id: int, group_id: int,
                       username: str | None, new: bool = False):
-    async with _session.begin() as conn:
+    async with _session().begin() as conn:
         if new:
-            return (await conn.execute(insert(User).returning(User), {
+            profile = (await conn.execute(insert(User).returning(User), {
                 'chat_id': chat_id,
                 'group_id': group_id,
                 'username': username
             })).first()[0]
         else:
-            return (await conn.execute(
+            profile = (await conn.execute(
                 update(User).where(User.chat_id == chat_id).values(
                     group_id=group_id, username=username
                 ).returning(User)
             )).first()[0]
+    profile_cache.set(chat_id, profile)
+    return profile
 
 
 async def get_profile(chat_id: int) -> User | None:
-    async with _session.begin() as session:
+    if (res := profile_cache.get(chat_id)) is not None:
+        return res
+    async with _read_session().begin() as session:
         res = (await session.execute(
             select(User).filter_by(chat_id=chat_id)
         )).first()
-        if not res:
-            return
-        return res[0]
+    res = res[0] if res else None
+    if res is not None:
+        profile_cache.set(chat_id, res)
+    return res
 
 
 async def update_profile(chat_id: int,
                          group_id: int, username: str | None) -> User:
-    profile = await get_profile(chat_id)
-    return await set_profile(chat_id, group_id, username, new=not profile)
+    async with _session().begin() as session:
+        profile = (await session.execute(_upsert(User, {
+            'chat_id': chat_id,
+            'group_id': group_id,
+            'username': username
+        }, index='chat_id', keep_existing=False).returning(User))).first()[0]
+    profile_cache.set(chat_id, profile)
+    return profile
+
+
+async def set_subscription(chat_id: int, notify_time: str | None,
+                           notify_days: int | None = 0b0111111) -> User | None:
+    """Subscribes to daily schedule (by default monday - saturday).
+    None time unsubscribes"""
+    async with _session().begin() as session:
+        profile = (await session.execute(
+            update(User).where(User.chat_id == chat_id).values(
+                notify_time=notify_time,
+                notify_days=notify_days if notify_time else None
+            ).returning(User)
+        )).first()
+    profile = profile[0] if profile else None
+    if profile is not None:
+        profile_cache.set(chat_id, profile)
+    return profile
+
+
+async def get_subscribers(notify_time: str,
+                          weekday: int) -> list[tuple[int, int]]:
+    """(chat_id, group_id) of users subscribed to time, who want schedule
+    of weekday"""
+    async with _read_session().begin() as session:
+        return [tuple(row) for row in (await session.execute(
+            select(User.chat_id, User.group_id).where(
+                User.notify_time == notify_time,
+                User.notify_days.op('&')(1 << weekday) != 0
+            )
+        )).all()]
+
+
+async def get_subscribed_groups() -> dict[int, list[int]]:
+    """group_id: chat ids of users subscribed to notifications"""
+    async with _read_session().begin() as session:
+        groups = {}
+        for chat_id, group_id in (await session.execute(
+            select(User.chat_id, User.group_id)
+            .where(User.notify_time.is_not(None))
+        )).all():
+            groups.setdefault(group_id, []).append(chat_id)
+        return groups
+
+
+def cache_stats() -> dict[str, dict[str, int]]:
+    return {
+        'profile': profile_cache.stats,
+        'group': group_cache.stats,
+        'teacher': teacher_cache.stats,
+    }
+
+
+def _add_missing_columns(sync_connection):
+    """New nullable columns of existing tables (create_all skips them)"""
+    inspector = inspect(sync_connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name']
+                    for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            sync_connection.execute(text(
+                f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" '
+                f'{column.type.compile(sync_connection.dialect)}'
+            ))
+
+
+async def migrate():
+    """Startup migration: creates tables, columns and indexes missing
+    in existing db"""
+    async with _engine().begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        for index in INDEXES:
+            await conn.execute(text(index))
 
 
 if __name__ == '__main__':
-    async def x():
-        s = await get_profile(1)
-        print(str(s.group_id))
-    pass
-    async def init_models():
-        res = await Teacher.get(1)
-        res = await Teacher.update_or_create(id=2, name='artasdasddudr', description='descriptionsadasd')
-        print(res)
-
-        return
-        async with __engine.begin() as conn:
-            #await conn.run_sync(Base.metadata.drop_all)
-            await conn.run_sync(Base.metadata.create_all)
-    asyncio.run(init_models())
+    # python db.py: creates (migrates) schema of DB_URL db.
+    asyncio.run(migrate())
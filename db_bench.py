@@ -0,0 +1,81 @@
+"""Read/write throughput of db with default and tuned SQLite settings.
+
+Usage:
+    python db_bench.py [--ops 2000] [--concurrency 20]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import db
+
+
+async def _run(func, ops: int, concurrency: int) -> float:
+    """Runs ``func(i)`` ops times by concurrency workers. Returns ops/s"""
+    counter = iter(range(ops))
+
+    async def worker():
+        for i in counter:
+            await func(i)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return ops / (time.perf_counter() - started)
+
+
+async def bench(name: str, write_engine, read_engine, ops: int,
+                concurrency: int):
+    async with write_engine.begin() as conn:
+        await conn.run_sync(db.Base.metadata.create_all)
+    write_session = async_sessionmaker(write_engine, expire_on_commit=False)
+    read_session = async_sessionmaker(read_engine, expire_on_commit=False)
+
+    async def write(i: int):
+        async with write_session.begin() as session:
+            await session.execute(db._upsert(db.User, {
+                'chat_id': i % 500,
+                'group_id': i,
+                'username': f'user{i}'
+            }, index='chat_id', keep_existing=False))
+
+    async def read(i: int):
+        async with read_session.begin() as session:
+            (await session.execute(
+                select(db.User).filter_by(chat_id=i % 500)
+            )).first()
+
+    writes = await _run(write, ops, concurrency)
+    reads = await _run(read, ops, concurrency)
+    print(f'{name:<8} writes: {writes:9.1f} ops/s   reads: {reads:9.1f} ops/s')
+    await write_engine.dispose()
+    await read_engine.dispose()
+
+
+async def main(ops: int, concurrency: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        url = 'sqlite+aiosqlite:///' + os.path.join(tmp, 'default.sqlite3')
+        engine = create_async_engine(url)
+        await bench('default', engine, engine, ops, concurrency)
+
+        url = 'sqlite+aiosqlite:///' + os.path.join(tmp, 'tuned.sqlite3')
+        await bench(
+            'tuned',
+            db.create_sqlite_engine(url, db.SQLITE_PROFILE, pool_size=1),
+            db.create_sqlite_engine(url, db.SQLITE_PROFILE,
+                                    pool_size=db.READ_POOL_SIZE,
+                                    read_only=True),
+            ops, concurrency
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ops', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.ops, args.concurrency))
@@ -0,0 +1,112 @@
+import datetime
+import sys
+
+
+class Lesson:
+    """Only what we render from upstream lesson (which has ~80 fields).
+
+    Date is parsed once, repeated strings are interned, so cached weeks
+    of many groups share lecturer/auditorium/discipline strings.
+    """
+    __slots__ = ('date', 'begin', 'discipline', 'lecturer', 'auditorium',
+                 '_hash')
+
+    def __init__(self, date: datetime.date, begin: str | None,
+                 discipline: str | None, lecturer: str | None,
+                 auditorium: str | None):
+        self.date = date
+        self.begin = _intern(begin)
+        self.discipline = _intern(discipline)
+        self.lecturer = _intern(lecturer)
+        self.auditorium = _intern(auditorium)
+        self._hash = hash((self.date, *self.fields()))
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'Lesson | None':
+        """None if lesson has no (valid) date"""
+        date = parse_date(data.get('date'))
+        if date is None:
+            return None
+        return cls(date, data.get('beginLesson'), data.get('discipline'),
+                   data.get('lecturer'), data.get('auditorium'))
+
+    def fields(self) -> tuple:
+        return (self.begin, self.discipline, self.lecturer, self.auditorium)
+
+    def as_list(self) -> list:
+        return [self.date.isoformat(), *self.fields()]
+
+    @classmethod
+    def from_list(cls, data: list) -> 'Lesson':
+        return cls(datetime.date.fromisoformat(data[0]), *data[1:])
+
+    def __eq__(self, other):
+        if not isinstance(other, Lesson):
+            return NotImplemented
+        return self.date == other.date and self.fields() == other.fields()
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return f'Lesson({self.date} {self.begin} {self.discipline!r})'
+
+
+class Schedule(list):
+    """List of lessons, which remembers when it was fetched from upstream"""
+
+    def __init__(self, lessons=(), fetched_at: float | None = None):
+        super().__init__(lessons)
+        self.fetched_at = fetched_at
+
+
+# Approx. bytes of Lesson with its date and list slot (strings are
+# interned, so they are shared, not counted).
+LESSON_SIZE = 150
+
+
+def approx_size(lessons: list[Lesson]) -> int:
+    """Approx. memory used by lessons, to bound memory cache"""
+    return 100 + LESSON_SIZE * len(lessons)
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def parse_date(value: str | None) -> datetime.date | None:
+    """Upstream date format is 2023.10.14"""
+    try:
+        return datetime.date(int(value[:4]), int(value[5:7]),
+                             int(value[8:10]))
+    except (TypeError, ValueError):
+        return None
+
+
+def as_date(value: str | datetime.date) -> datetime.date:
+    """date from date, datetime or 2023-10-14 (2023.10.14) string"""
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10].replace('.', '-'))
+
+
+def parse_schedule(data: list[dict] | None) -> list[Lesson] | None:
+    """Upstream schedule json to lessons. None (upstream error) stays None"""
+    if data is None:
+        return None
+    return [lesson for lesson in map(Lesson.from_json, data) if lesson]
+
+
+def encode(lessons: list[Lesson] | None) -> list[list] | None:
+    """To json-compatible form (for redis cache)"""
+    if lessons is None:
+        return None
+    return [lesson.as_list() for lesson in lessons]
+
+
+def decode(data: list[list] | None) -> list[Lesson] | None:
+    if data is None:
+        return None
+    return [Lesson.from_list(item) for item in data]
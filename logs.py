@@ -0,0 +1,126 @@
+"""Logging setup: records are put into queue by the calling coroutine and
+written (file as JSON lines, console as text) by listener thread, so
+logging never waits for disk in event loop.
+
+Extra fields (``log.info(..., extra={'update_id': 1, 'latency': 0.1})``)
+become fields of JSON record. Only ``debug_sample_rate`` part of DEBUG
+records is kept (they are per update/message, too many to keep all).
+"""
+import atexit
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+
+from aiogram import BaseMiddleware
+
+log = logging.getLogger(__name__)
+
+# Attributes every LogRecord has, everything else came from ``extra``.
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        data.update((k, v) for k, v in vars(record).items()
+                    if k not in _RECORD_FIELDS)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps ``rate`` part of records of ``level`` and lower"""
+
+    def __init__(self, rate: float, level: int = logging.DEBUG):
+        super().__init__()
+        self.rate = rate
+        self.level = level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > self.level or random.random() < self.rate
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Like QueueHandler.prepare, but keeps traceback out of message"""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup(path: str | None = None, filename: str | None = None,
+          level: str | None = None,
+          debug_sample_rate: float | None = None
+          ) -> logging.handlers.QueueListener:
+    """Sends records of all loggers through queue to file and console.
+    Listener is stopped (queue flushed) at exit"""
+    path = path or os.environ.get('LOG_PATH', '.')
+    filename = filename or os.environ.get('LOG_FILE', 'rasp_bot_log.log')
+    level = level or os.environ.get('LOG_LEVEL', 'INFO')
+    if debug_sample_rate is None:
+        debug_sample_rate = float(os.environ.get('LOG_DEBUG_SAMPLE', 0.01))
+
+    file_handler = logging.FileHandler(f'{path}/{filename}.log',
+                                       encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(
+        '%(asctime)s [%(threadName)-12.12s] [%(levelname)-5.5s]  %(message)s'
+    ))
+    records = queue.SimpleQueue()
+    queue_handler = _QueueHandler(records)
+    queue_handler.addFilter(SamplingFilter(debug_sample_rate))
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(
+        records, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop, listener)
+    return listener
+
+
+def _stop(listener: logging.handlers.QueueListener):
+    if listener._thread is not None:  # stop() of stopped one fails.
+        listener.stop()
+
+
+class UpdateLogging(BaseMiddleware):
+    """Outer update middleware: logs every update (DEBUG, sampled) and
+    failed ones (WARNING) with update id, chat and processing time"""
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        chat = data.get('event_chat')
+        extra = {'update_id': getattr(event, 'update_id', None),
+                 'event_type': getattr(event, 'event_type', None),
+                 'chat_id': chat.id if chat else None}
+        try:
+            res = await handler(event, data)
+        except Exception as exc:
+            # Traceback is logged by webhook server / polling loop.
+            extra['latency'] = round(time.perf_counter() - started, 6)
+            log.warning('Update failed: %r', exc, extra=extra)
+            raise
+        if log.isEnabledFor(logging.DEBUG):
+            extra['latency'] = round(time.perf_counter() - started, 6)
+            log.debug('Update processed', extra=extra)
+        return res
@@ -0,0 +1,68 @@
+from aiogram.fsm.storage.base import StorageKey
+
+# Telegram doesn't allow to delete messages older than 48 hours anyway.
+DEFAULT_TTL = 48 * 60 * 60
+
+
+class MessageStore:
+    """Message ids kept for later cleanup, stored in native redis types.
+
+    Every operation is one pipelined (MULTI/EXEC) round-trip, so concurrent
+    updates of same chat don't overwrite each other as get_data/update_data
+    of FSM storage did.
+    """
+
+    def __init__(self, redis, prefix: str = 'rasp_messages',
+                 ttl: int = DEFAULT_TTL):
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, key: StorageKey, part: str) -> str:
+        return f'{self.prefix}:{key.bot_id}:{key.chat_id}:{key.user_id}:{part}'
+
+    async def add_to_delete(self, key: StorageKey, *message_ids: int):
+        name = self._key(key, 'delete_after')
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.sadd(name, *message_ids)
+            pipe.expire(name, self.ttl)
+            await pipe.execute()
+
+    async def pop_to_delete(self, key: StorageKey) -> list[int]:
+        """Returns and clears ids to delete, except last schedule message"""
+        name = self._key(key, 'delete_after')
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.smembers(name)
+            pipe.get(self._key(key, 'last_schedule'))
+            pipe.delete(name)
+            members, last_schedule, _ = await pipe.execute()
+        last_schedule = int(last_schedule) if last_schedule else None
+        return [int(message_id) for message_id in members
+                if int(message_id) != last_schedule]
+
+    async def add_menu(self, key: StorageKey, message_id: int):
+        name = self._key(key, 'menu')
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(name, message_id)
+            pipe.expire(name, self.ttl)
+            await pipe.execute()
+
+    async def pop_menu(self, key: StorageKey) -> list[int]:
+        name = self._key(key, 'menu')
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrange(name, 0, -1)
+            pipe.delete(name)
+            members, _ = await pipe.execute()
+        return [int(message_id) for message_id in members]
+
+    async def set_last_schedule(self, key: StorageKey, message_id: int):
+        await self.redis.set(self._key(key, 'last_schedule'), message_id,
+                             ex=self.ttl)
+
+    async def pop_last_schedule(self, key: StorageKey) -> int | None:
+        name = self._key(key, 'last_schedule')
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.get(name)
+            pipe.delete(name)
+            last, _ = await pipe.execute()
+        return int(last) if last else None
@@ -0,0 +1,189 @@
+"""Prometheus metrics.
+
+Timings are recorded into in-process histograms (a few dict lookups and
+additions per call); text format is generated only when ``/metrics`` is
+scraped, by the exporter thread of prometheus_client, not in event loop.
+"""
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware, NextRequestMiddlewareType
+)
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+log = logging.getLogger(__name__)
+
+# Upstream and Telegram calls take 10ms-10s, db and redis ones 0.1ms-1s.
+SLOW_BUCKETS = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+FAST_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05,
+                .1, .25, 1)
+
+HANDLER_SECONDS = Histogram('bot_handler_seconds', 'Update handler time',
+                            ['handler'], buckets=SLOW_BUCKETS)
+HANDLER_ERRORS = Counter('bot_handler_errors_total',
+                         'Handlers failed with exception', ['handler'])
+UPSTREAM_SECONDS = Histogram('rasp_request_seconds',
+                             'rasp.omgtu.ru request attempt time',
+                             ['outcome'], buckets=SLOW_BUCKETS)
+UPSTREAM_REJECTED = Counter('rasp_breaker_rejected_total',
+                            'Requests failed fast by circuit breaker')
+BREAKER_STATE = Gauge('rasp_breaker_state',
+                      'Circuit breaker state: 0 closed, 1 half-open, 2 open')
+BREAKER_OPENED = Gauge('rasp_breaker_opened',
+                       'Times circuit breaker has opened since start')
+DB_SECONDS = Histogram('db_query_seconds', 'SQL statement time',
+                       ['statement'], buckets=FAST_BUCKETS)
+REDIS_SECONDS = Histogram('redis_command_seconds', 'Redis round-trip time',
+                          ['command'], buckets=FAST_BUCKETS)
+TELEGRAM_SECONDS = Histogram('telegram_request_seconds',
+                             'Telegram Bot API call time', ['method'],
+                             buckets=SLOW_BUCKETS)
+TELEGRAM_ERRORS = Counter('telegram_request_errors_total',
+                          'Failed Telegram Bot API calls', ['method'])
+OUTBOUND_QUEUE_DEPTH = Gauge('telegram_outbound_queue_depth',
+                             'Telegram calls waiting for rate limit',
+                             ['priority'])
+COLD_START_SECONDS = Gauge('bot_cold_start_seconds',
+                           'Time of import, create_app and startup phases',
+                           ['phase'])
+LOOP_LAG_SECONDS = Histogram('event_loop_lag_seconds',
+                             'Event loop lag (in profiling mode)',
+                             buckets=FAST_BUCKETS)
+
+
+class HandlerMetrics(BaseMiddleware):
+    """Inner middleware (router.message.middleware(...)): times handler
+    chosen for the update, labelled by its function name"""
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any]
+    ) -> Any:
+        handler_object = data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__',
+                       'unknown')
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(name).inc()
+            raise
+        finally:
+            HANDLER_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+class TelegramMetrics(BaseRequestMiddleware):
+    """Bot session middleware. Registered after outbound limiter, so time
+    spent waiting for rate limit is not counted"""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType,
+                       bot: Bot, method: TelegramMethod):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            TELEGRAM_ERRORS.labels(name).inc()
+            raise
+        finally:
+            TELEGRAM_SECONDS.labels(name).observe(
+                time.perf_counter() - started)
+
+
+def instrument_router(router):
+    middleware = HandlerMetrics()
+    for observer in router.observers.values():
+        if observer.event_name not in ('update', 'error'):
+            observer.middleware(middleware)
+
+
+def instrument_outbound(limiter):
+    """Exports queue depth of OutboundLimiter, read when scraped"""
+    for priority in ('high', 'low'):
+        OUTBOUND_QUEUE_DEPTH.labels(priority).set_function(
+            lambda key=f'queue_depth_{priority}': limiter.metrics()[key])
+
+
+def instrument_breaker(breaker):
+    """Exports state and open count of api.CircuitBreaker, read when
+    scraped"""
+    states = {breaker.CLOSED: 0, breaker.HALF_OPEN: 1, breaker.OPEN: 2}
+    BREAKER_STATE.set_function(lambda: states[breaker.state])
+    BREAKER_OPENED.set_function(lambda: breaker.stats['opened'])
+
+
+def instrument_engine(sync_engine):
+    """Times statements of SQLAlchemy engine (``engine.sync_engine`` of
+    async one), labelled by first word of statement"""
+    from sqlalchemy import event
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def _before(_conn, _cursor, _statement, _parameters, context,
+                _executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def _after(_conn, _cursor, statement, _parameters, context,
+               _executemany):
+        DB_SECONDS.labels(statement.lstrip()[:6].upper()).observe(
+            time.perf_counter() - context._metrics_started)
+
+
+def instrument_redis(client):
+    """Times commands and pipelines of redis.asyncio client"""
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    async def timed_execute_command(*args, **options):
+        started = time.perf_counter()
+        try:
+            return await execute_command(*args, **options)
+        finally:
+            REDIS_SECONDS.labels(str(args[0]).upper()).observe(
+                time.perf_counter() - started)
+
+    def timed_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def timed_execute(*execute_args, **execute_kwargs):
+            started = time.perf_counter()
+            try:
+                return await execute(*execute_args, **execute_kwargs)
+            finally:
+                REDIS_SECONDS.labels('PIPELINE').observe(
+                    time.perf_counter() - started)
+
+        pipe.execute = timed_execute
+        return pipe
+
+    client.execute_command = timed_execute_command
+    client.pipeline = timed_pipeline
+
+
+def serve(port: int | None = None, host: str | None = None) -> int:
+    """Starts /metrics exporter (in thread). Port 0 disables it. Runner
+    workers use port + worker index. Returns port or 0 (also if port is
+    busy: metrics are optional, bot works without them)"""
+    if port is None:
+        port = int(os.environ.get('METRICS_PORT', 9108))
+    host = host or os.environ.get('METRICS_HOST', '127.0.0.1')
+    if not port:
+        return 0
+    port += int(os.environ.get('WORKER_INDEX', 0))
+    try:
+        start_http_server(port, addr=host)
+    except OSError as exc:
+        log.warning('Metrics exporter is not started on %s:%d: %s',
+                    host, port, exc)
+        return 0
+    log.info('Metrics are available at http://%s:%d/metrics', host, port)
+    return port
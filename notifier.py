@@ -0,0 +1,103 @@
+import asyncio
+import datetime
+import logging
+import os
+import time
+import zoneinfo
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+
+import api
+from render import generate_schedule_str
+
+log = logging.getLogger(__name__)
+
+TIMEZONE = zoneinfo.ZoneInfo(os.environ.get('NOTIFY_TIMEZONE', 'Asia/Omsk'))
+# Times users can choose. Evening ones send schedule for tomorrow.
+NOTIFY_TIMES = ('06:30', '07:00', '07:30', '08:00', '20:00', '21:00')
+
+
+def schedule_day(notify_time: str, today: datetime.date) -> datetime.date:
+    return today if int(notify_time[:2]) < 12 else \
+        today + datetime.timedelta(days=1)
+
+
+async def render_for_group(group_id: int, day: datetime.date) -> str | None:
+    """Rendered text of group schedule for day (None if there're no lessons)"""
+    import db
+    schedule = await api.get_schedule(group_id, api.SearchType.GROUP,
+                                      dates=(day, day))
+    lessons = generate_schedule_str(schedule, (day, day))
+    if not lessons:
+        return None
+    group = await db.get_group(group_id)
+    label = group.label if group else group_id
+    return (f'Расписание группы <b>{label}</b> на '
+            f'{day:%d.%m.%Y}\n\n' + lessons)
+
+
+async def send_slot(bot: Bot, notify_time: str, now: datetime.datetime,
+                    concurrency: int = 30) -> dict[str, float]:
+    """Sends schedules to everybody subscribed to time.
+
+    Subscribers are grouped by group: schedule is fetched and rendered once
+    per group, not per user. Sending pace is kept by bot's outbound limiter.
+    """
+    import db
+    started = time.perf_counter()
+    day = schedule_day(notify_time, now.date())
+    groups: dict[int, list[int]] = {}
+    # Days are days of schedule: evening slot of sunday sends monday.
+    for chat_id, group_id in await db.get_subscribers(notify_time,
+                                                      day.weekday()):
+        groups.setdefault(group_id, []).append(chat_id)
+    texts = dict(zip(groups, await asyncio.gather(*(
+        render_for_group(group_id, day) for group_id in groups
+    ))))
+    semaphore = asyncio.Semaphore(concurrency)
+    report = {'groups': len(groups), 'delivered': 0, 'failed': 0}
+
+    async def deliver(chat_id: int, text: str):
+        async with semaphore:
+            try:
+                await bot.send_message(chat_id, text)
+                report['delivered'] += 1
+            except TelegramForbiddenError:  # Bot was blocked by user.
+                report['failed'] += 1
+                await db.set_subscription(chat_id, None)
+            except TelegramAPIError as exc:
+                report['failed'] += 1
+                log.warning('Notification to %s failed: %s', chat_id, exc)
+
+    await asyncio.gather(*(
+        deliver(chat_id, texts[group_id])
+        for group_id, chats in groups.items() if texts[group_id]
+        for chat_id in chats
+    ))
+    elapsed = time.perf_counter() - started
+    report['elapsed'] = round(elapsed, 3)
+    report['per_second'] = round(report['delivered'] / elapsed, 1) \
+        if elapsed else 0
+    log.info('Notifications %s %s: %s', day, notify_time, report)
+    return report
+
+
+async def run(bot: Bot):
+    """Background task, wakes up at start of every notification time"""
+    while True:
+        now = datetime.datetime.now(TIMEZONE)
+        upcoming = []
+        for notify_time in NOTIFY_TIMES:
+            hour, minute = map(int, notify_time.split(':'))
+            slot = now.replace(hour=hour, minute=minute, second=0,
+                               microsecond=0)
+            if slot <= now:
+                slot += datetime.timedelta(days=1)
+            upcoming.append((slot, notify_time))
+        slot, notify_time = min(upcoming)
+        await asyncio.sleep((slot - now).total_seconds())
+        try:
+            await send_slot(bot, notify_time, slot)
+        except Exception as exc:
+            log.exception('Notifications of %s failed: %s', notify_time, exc)
@@ -0,0 +1,142 @@
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware, NextRequestMiddlewareType
+)
+from aiogram.methods import TelegramMethod
+
+HIGH, LOW = 0, 1
+# Cleanup, user doesn't wait for it.
+LOW_PRIORITY_METHODS = {'deleteMessage', 'deleteMessages'}
+# Methods limited per chat (sending and changing visible messages).
+CHAT_LIMITED_METHODS = {
+    'sendMessage', 'editMessageText', 'editMessageReplyMarkup',
+    'sendPhoto', 'sendDocument', 'copyMessage', 'forwardMessage',
+}
+MERGEABLE_METHODS = {'editMessageText', 'editMessageReplyMarkup'}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds to wait until token is available"""
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    @property
+    def idle(self) -> bool:
+        return self.tokens >= self.capacity
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """Keeps bot within Telegram flood limits instead of getting 429.
+
+    Every API call waits for a token of global bucket (and of chat bucket
+    for sending/editing). Deletes have lower priority: they don't take
+    the last global token while user-visible calls are waiting. Edits of
+    same message, queued before previous one was sent, are merged: only
+    the last one is sent and all callers get its result.
+    """
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1,
+                 chat_burst: float = 3):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets: dict[int | str, TokenBucket] = {}
+        self.depth = {HIGH: 0, LOW: 0}
+        self.stats = {'sent': 0, 'merged': 0, 'max_depth': 0}
+        self._pending_edits: dict[tuple, list] = {}
+
+    def metrics(self) -> dict[str, int]:
+        return {
+            'queue_depth_high': self.depth[HIGH],
+            'queue_depth_low': self.depth[LOW],
+            **self.stats,
+        }
+
+    async def __call__(self, make_request: NextRequestMiddlewareType,
+                       bot: Bot, method: TelegramMethod):
+        api_method = method.__api_method__
+        if api_method not in MERGEABLE_METHODS:
+            await self._acquire(method)
+            return await make_request(bot, method)
+        edit_key = (api_method, getattr(method, 'chat_id', None),
+                    getattr(method, 'message_id', None),
+                    getattr(method, 'inline_message_id', None))
+        if pending := self._pending_edits.get(edit_key):
+            pending[0] = method
+            self.stats['merged'] += 1
+            return await asyncio.shield(pending[1])
+        pending = [method, asyncio.get_running_loop().create_future()]
+        self._pending_edits[edit_key] = pending
+        try:
+            try:
+                await self._acquire(method)
+            finally:
+                self._pending_edits.pop(edit_key, None)
+            result = await make_request(bot, pending[0])
+        except asyncio.CancelledError:
+            pending[1].cancel()
+            raise
+        except Exception as exc:
+            pending[1].set_exception(exc)
+            pending[1].exception()  # Mark retrieved if nobody waits.
+            raise
+        pending[1].set_result(result)
+        return result
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                now = time.monotonic()
+                for key, old in list(self.chat_buckets.items()):
+                    old._refill(now)
+                    if old.idle:
+                        del self.chat_buckets[key]
+            bucket = self.chat_buckets[chat_id] = TokenBucket(
+                self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, method: TelegramMethod):
+        api_method = method.__api_method__
+        priority = LOW if api_method in LOW_PRIORITY_METHODS else HIGH
+        chat_id = getattr(method, 'chat_id', None)
+        chat_bucket = self._chat_bucket(chat_id) if (
+            chat_id is not None and api_method in CHAT_LIMITED_METHODS
+        ) else None
+        self.depth[priority] += 1
+        self.stats['max_depth'] = max(self.stats['max_depth'],
+                                      self.depth[HIGH] + self.depth[LOW])
+        try:
+            while True:
+                now = time.monotonic()
+                wait = max(self.global_bucket.delay(now),
+                           chat_bucket.delay(now) if chat_bucket else 0)
+                # Last global token is kept for user-visible calls.
+                if wait == 0 and (priority == HIGH or not self.depth[HIGH]
+                                  or self.global_bucket.tokens >= 2):
+                    self.global_bucket.consume()
+                    if chat_bucket:
+                        chat_bucket.consume()
+                    self.stats['sent'] += 1
+                    return
+                await asyncio.sleep(wait or 1 / self.global_bucket.rate)
+        finally:
+            self.depth[priority] -= 1
@@ -0,0 +1,146 @@
+"""Optional profiling mode (PROFILING=1), to tell blocked event loop from
+slow I/O.
+
+- loop lag: task expecting to wake up every ``interval`` seconds measures
+  how late it is (``loop_lag_seconds`` histogram, warning above
+  ``threshold``);
+- slow callbacks: watchdog thread notices loop which hasn't ticked for
+  ``threshold`` seconds and logs stack of what is running in it right now;
+- snapshots: sampling profiler collects stacks of loop thread for some
+  seconds into collapsed stacks file (flamegraph.pl / speedscope format),
+  on SIGUSR1 or /profile command of admin.
+
+Everything runs in threads or sleeps, nothing is hooked into every
+callback, so enabled mode costs a wakeup per ``interval``.
+"""
+import asyncio
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+
+def _frame_key(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:' \
+           f'{frame.f_lineno})'
+
+
+class Profiler:
+    def __init__(self, interval: float = 0.5, threshold: float = 0.1,
+                 directory: str = '.', sample_interval: float = 0.005):
+        self.interval = interval
+        self.threshold = threshold
+        self.directory = directory
+        self.sample_interval = sample_interval
+        self.stats = {'lag_max': 0.0, 'slow': 0, 'snapshots': 0}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._heartbeat = time.monotonic()
+        self._lag_task: asyncio.Task | None = None
+        self._stopped = threading.Event()
+        self._watchdog: threading.Thread | None = None
+        self._snapshot_lock = threading.Lock()
+
+    def start(self):
+        """Must be called from running event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._lag_task = asyncio.create_task(self._measure_lag())
+        self._watchdog = threading.Thread(target=self._watch, daemon=True,
+                                          name='loop-watchdog')
+        self._watchdog.start()
+        if hasattr(signal, 'SIGUSR1'):
+            self._loop.add_signal_handler(signal.SIGUSR1, self.snapshot)
+        log.info('Profiling enabled: lag interval %ss, slow threshold %ss',
+                 self.interval, self.threshold)
+
+    def stop(self):
+        self._stopped.set()
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+        if self._loop is not None and hasattr(signal, 'SIGUSR1'):
+            self._loop.remove_signal_handler(signal.SIGUSR1)
+
+    async def _measure_lag(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(now - expected, 0)
+            metrics.LOOP_LAG_SECONDS.observe(lag)
+            self.stats['lag_max'] = max(self.stats['lag_max'], lag)
+            if lag > self.threshold:
+                log.warning('Event loop lag %.3fs', lag,
+                            extra={'loop_lag': round(lag, 6)})
+
+    def _watch(self):
+        """Logs stack of loop thread once per stall"""
+        reported = None
+        while not self._stopped.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.threshold or reported == heartbeat:
+                continue
+            reported = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            self.stats['slow'] += 1
+            log.warning('Event loop blocked for %.3fs in:\n%s', stalled,
+                        ''.join(traceback.format_stack(frame)),
+                        extra={'blocked': round(stalled, 6)})
+
+    def snapshot(self, seconds: float = 10) -> threading.Thread | None:
+        """Samples loop thread stacks in background thread, writes
+        collapsed stacks to ``directory``. None if one is running"""
+        if not self._snapshot_lock.acquire(blocking=False):
+            log.warning('Profile snapshot is already running')
+            return None
+        thread = threading.Thread(target=self._sample, args=(seconds,),
+                                  daemon=True, name='profile-sampler')
+        thread.start()
+        return thread
+
+    def _sample(self, seconds: float):
+        try:
+            stacks = collections.Counter()
+            finish = time.monotonic() + seconds
+            while time.monotonic() < finish and not self._stopped.is_set():
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_key(frame))
+                    frame = frame.f_back
+                if stack:
+                    stacks[';'.join(reversed(stack))] += 1
+                time.sleep(self.sample_interval)
+            path = os.path.join(
+                self.directory,
+                f'profile-{os.getpid()}-{time.strftime("%Y%m%d-%H%M%S")}.txt')
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f'{stack} {count}\n')
+            self.stats['snapshots'] += 1
+            log.info('Profile snapshot (%d samples) saved to %s',
+                     sum(stacks.values()), path)
+        finally:
+            self._snapshot_lock.release()
+
+
+profiler = Profiler(
+    interval=float(os.environ.get('PROFILE_LAG_INTERVAL', 0.5)),
+    threshold=float(os.environ.get('PROFILE_SLOW_THRESHOLD', 0.1)),
+    directory=os.environ.get('PROFILE_DIR', '.'),
+)
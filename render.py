@@ -0,0 +1,48 @@
+import datetime
+import html
+import os
+
+import cache
+from lessons import Lesson, as_date
+
+# Rendered days. Key is the day's content itself, so when schedule of
+# the day changes, it just gets another key, nothing to invalidate.
+fragment_cache = cache.LRUCache(int(os.environ.get('RENDER_CACHE_SIZE',
+                                                   20000)))
+
+
+def render_lesson(lesson: Lesson) -> str:
+    res = (f'\t\t<u>{html.escape(str(lesson.begin))}</u> '
+           f'<b>{html.escape(str(lesson.discipline))}</b>\n')
+    lecturer, auditorium = lesson.lecturer, lesson.auditorium
+    if lecturer and auditorium:
+        res += (f'\t\t{html.escape(lecturer)} '
+                f'({html.escape(auditorium)}) \n')
+    elif lecturer or auditorium:
+        res += f'\t\t{html.escape(lecturer or f"({auditorium})")} \n'
+    return res
+
+
+def render_day(date: datetime.date, lessons: list[Lesson]) -> str:
+    """Day header and its lessons. Cached"""
+    key = (date, tuple(lessons))
+    res = fragment_cache.get(key)
+    if res is None:
+        res = ''.join([str(date), '\n', *map(render_lesson, lessons),
+                       '\n\n'])
+        fragment_cache.set(key, res)
+    return res
+
+
+def generate_schedule_str(schedule: list[Lesson] | None, dates=()) -> str:
+    """Groups lessons by date (in one pass, filtering by dates range)
+    and joins rendered days"""
+    start, finish = (as_date(dates[0]), as_date(dates[-1])) \
+        if dates else (None, None)
+    days: dict[datetime.date, list[Lesson]] = {}
+    for lesson in schedule or ():
+        if start is not None and not start <= lesson.date <= finish:
+            continue
+        days.setdefault(lesson.date, []).append(lesson)
+    return ''.join(render_day(date, lessons)
+                   for date, lessons in days.items())
@@ -0,0 +1,54 @@
+"""Microbenchmark of schedule rendering (cold and hot fragment cache).
+
+Usage:
+    python render_bench.py [--number 2000]
+"""
+import argparse
+import copy
+import datetime
+import json
+import timeit
+
+import render
+from lessons import parse_schedule
+
+
+def sample_week() -> list[dict]:
+    """Week of 4 lessons per day, based on recorded main.json lessons"""
+    with open('main.json', encoding='utf-8') as f:
+        recorded = json.load(f)
+    start = datetime.date(2023, 10, 9)
+    week = []
+    for day in range(6):
+        date = (start + datetime.timedelta(days=day)).strftime('%Y.%m.%d')
+        for number in range(4):
+            lesson = copy.deepcopy(recorded[number % len(recorded)])
+            lesson['date'] = date
+            lesson['beginLesson'] = f'{8 + number * 2:02}:00'
+            week.append(lesson)
+    return week
+
+
+def main(number: int):
+    raw = sample_week()
+    week = parse_schedule(raw)
+    dates = (datetime.date(2023, 10, 9), datetime.date(2023, 10, 15))
+
+    def cold():
+        render.fragment_cache.clear()
+        render.generate_schedule_str(week, dates)
+
+    def hot():
+        render.generate_schedule_str(week, dates)
+
+    for name, func in (('cold', cold), ('hot', hot)):
+        elapsed = timeit.timeit(func, number=number)
+        print(f'{name}: {elapsed / number * 1e6:8.1f} us per week')
+    elapsed = timeit.timeit(lambda: parse_schedule(raw), number=number)
+    print(f'parse: {elapsed / number * 1e6:8.1f} us per week')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=2000)
+    main(parser.parse_args().number)
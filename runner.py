@@ -0,0 +1,159 @@
+"""Multi-worker runner.
+
+Front process receives webhook updates and passes each one to one of N
+worker processes, chosen by chat id, so updates of one chat are always
+processed by the same worker in order. Every worker is a separate
+``bot`` process (own dispatcher, Bot, connections and caches) running
+webhook server on local port; FSM data and schedule cache are shared
+through Redis.
+
+Usage:
+    WORKERS=4 WEBHOOK_URL=https://example.com python runner.py
+
+Long polling can't be split between processes (there is only one
+getUpdates consumer), so runner works in webhook mode only.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+
+import aiohttp
+from aiohttp import web
+from dotenv import load_dotenv
+
+import logs
+from webhook import SECRET_HEADER, partition_key
+
+log = logging.getLogger(__name__)
+
+
+def worker_main(index: int, port: int):
+    os.environ.update({
+        'BOT_MODE': 'webhook',
+        'WEBHOOK_HOST': '127.0.0.1',
+        'WEBHOOK_PORT': str(port),
+        'WEBHOOK_PATH': '/webhook',
+        'WORKER_INDEX': str(index),
+        # Webhook is set by front, secret is checked by front.
+        'WEBHOOK_URL': '',
+        'WEBHOOK_SECRET': '',
+        # Schema is migrated by front, once, not by workers concurrently.
+        'DB_MIGRATE': '0',
+    })
+    # Background jobs must run once, not in every worker.
+    if index:
+        os.environ['CATALOG_SYNC_INTERVAL'] = '0'
+        os.environ['NOTIFY_ENABLED'] = '0'
+        os.environ['CHANGES_ENABLED'] = '0'
+    os.environ.setdefault('SCHEDULE_CACHE_BACKEND', 'redis')
+    import bot
+    bot.main()
+
+
+class Runner:
+    def __init__(self, workers: int, base_port: int, path: str = '/webhook',
+                 secret_token: str | None = None):
+        self.path = path
+        self.secret_token = secret_token
+        self.ports = [base_port + i for i in range(workers)]
+        # spawn: worker imports bot from scratch, nothing is shared by fork.
+        self._context = multiprocessing.get_context('spawn')
+        self.processes: list[multiprocessing.Process | None] = \
+            [None] * workers
+        self._session: aiohttp.ClientSession | None = None
+        self._monitor: asyncio.Task | None = None
+
+    def _start_worker(self, index: int):
+        process = self._context.Process(
+            target=worker_main, args=(index, self.ports[index]),
+            name=f'rasp-worker-{index}', daemon=False
+        )
+        process.start()
+        self.processes[index] = process
+        log.info('Worker %d started (pid %s)', index, process.pid)
+
+    async def _watch(self):
+        """Restarts dead workers"""
+        while True:
+            await asyncio.sleep(5)
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    log.warning('Worker %d died with code %s, restarting',
+                                index, process.exitcode)
+                    self._start_worker(index)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and \
+                request.headers.get(SECRET_HEADER) != self.secret_token:
+            return web.Response(status=401)
+        body = await request.read()
+        try:
+            index = partition_key(await request.json()) % len(self.ports)
+        except ValueError:
+            return web.Response(status=400)
+        url = f'http://127.0.0.1:{self.ports[index]}{self.path}'
+        try:
+            async with self._session.post(
+                    url, data=body,
+                    headers={'Content-Type': 'application/json'}) as resp:
+                return web.Response(status=resp.status)
+        except aiohttp.ClientError:
+            # Worker is (re)starting. Telegram will retry.
+            return web.Response(status=503)
+
+    def app(self, webhook_url: str | None = None,
+            token: str | None = None) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+
+        async def on_startup(_app: web.Application):
+            import db
+            await db.migrate()
+            await db.close()
+            for index in range(len(self.ports)):
+                self._start_worker(index)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=0))
+            self._monitor = asyncio.create_task(self._watch())
+            if webhook_url and token:
+                from aiogram import Bot
+                telegram = Bot(token)
+                await telegram.set_webhook(
+                    webhook_url.rstrip('/') + self.path,
+                    secret_token=self.secret_token
+                )
+                await telegram.session.close()
+
+        async def on_shutdown(_app: web.Application):
+            self._monitor.cancel()
+            for process in self.processes:
+                process.terminate()  # SIGTERM, worker drains its updates.
+            for process in self.processes:
+                await asyncio.to_thread(process.join)
+            await self._session.close()
+
+        app.on_startup.append(on_startup)
+        app.on_shutdown.append(on_shutdown)
+        return app
+
+
+def main():
+    load_dotenv()  # Spawned workers inherit env before importing bot.
+    logs.setup()
+    port = int(os.environ.get('WEBHOOK_PORT', 8080))
+    runner = Runner(
+        workers=int(os.environ.get('WORKERS', os.cpu_count() or 1)),
+        base_port=int(os.environ.get('WORKERS_BASE_PORT', port + 1)),
+        path=os.environ.get('WEBHOOK_PATH', '/webhook'),
+        secret_token=os.environ.get('WEBHOOK_SECRET'),
+    )
+    web.run_app(
+        runner.app(os.environ.get('WEBHOOK_URL'),
+                   os.environ.get('TELEGRAM_TOKEN')),
+        host=os.environ.get('WEBHOOK_HOST', '0.0.0.0'), port=port
+    )
+
+
+if __name__ == '__main__':
+    main()
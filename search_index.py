@@ -0,0 +1,257 @@
+import bisect
+import os
+import time
+
+import api
+
+TRANSLIT = {
+    'shch': 'щ', 'sch': 'щ', 'yo': 'е', 'zh': 'ж', 'kh': 'х', 'ts': 'ц',
+    'ch': 'ч', 'sh': 'ш', 'yu': 'ю', 'ya': 'я', 'a': 'а', 'b': 'б',
+    'v': 'в', 'g': 'г', 'd': 'д', 'e': 'е', 'z': 'з', 'i': 'и', 'j': 'й',
+    'k': 'к', 'l': 'л', 'm': 'м', 'n': 'н', 'o': 'о', 'p': 'п', 'r': 'р',
+    's': 'с', 't': 'т', 'u': 'у', 'f': 'ф', 'h': 'х', 'c': 'ц', 'y': 'ы',
+    'w': 'в', 'x': 'кс', 'q': 'к',
+}
+# Typed with english keyboard layout instead of russian one.
+LAYOUT = dict(zip('qwertyuiop[]asdfghjkl;\'zxcvbnm,.`',
+                  'йцукенгшщзхъфывапролджэячсмитьбюё'))
+
+
+def normalize(text: str) -> str:
+    """Lowercase, ё -> е, only letters and digits are left"""
+    return ''.join(
+        ch for ch in text.lower().replace('ё', 'е') if ch.isalnum()
+    )
+
+
+def transliterate(text: str) -> str:
+    res, i = [], 0
+    while i < len(text):
+        for size in (4, 3, 2, 1):
+            chunk = text[i:i + size]
+            if chunk in TRANSLIT:
+                res.append(TRANSLIT[chunk])
+                i += size
+                break
+        else:
+            res.append(text[i])
+            i += 1
+    return ''.join(res)
+
+
+def switch_layout(text: str) -> str:
+    return ''.join(LAYOUT.get(ch, ch) for ch in text.lower())
+
+
+def trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """In-memory index of one entity type (groups or teachers).
+
+    Substring matches are found through trigram posting lists (prefix
+    search for queries shorter than 3 chars). Typos are handled by
+    trigram similarity, but only as suggestions (``suggest``): similar
+    label is often another group (ФИТ-211 / ФИТ-212).
+    """
+
+    def __init__(self, min_similarity: float = 0.6, limit: int = 50):
+        self.min_similarity = min_similarity
+        self.limit = limit
+        self.entities: dict[int, dict] = {}
+        self._normalized: dict[int, str] = {}
+        self._trigrams: dict[str, set[int]] = {}
+        self._sorted: list[tuple[str, int]] = []
+
+    def __len__(self):
+        return len(self.entities)
+
+    def add(self, id_: int, label: str, description: str | None = None):
+        id_ = int(id_)
+        if id_ in self.entities:
+            self._remove(id_)
+        norm = normalize(label or '')
+        self.entities[id_] = {'id': id_, 'label': label,
+                              'description': description}
+        self._normalized[id_] = norm
+        for trigram in trigrams(norm):
+            self._trigrams.setdefault(trigram, set()).add(id_)
+        bisect.insort(self._sorted, (norm, id_))
+
+    def _remove(self, id_: int):
+        norm = self._normalized.pop(id_)
+        self.entities.pop(id_)
+        for trigram in trigrams(norm):
+            self._trigrams.get(trigram, set()).discard(id_)
+        pos = bisect.bisect_left(self._sorted, (norm, id_))
+        if pos < len(self._sorted) and self._sorted[pos] == (norm, id_):
+            self._sorted.pop(pos)
+
+    def search(self, term: str) -> list[dict]:
+        """Exact, prefix and substring matches (exact first)"""
+        for variant in self._variants(term):
+            found = self._find(variant)
+            if found:
+                return [self.entities[id_] for id_ in found[:self.limit]]
+        return []
+
+    def exact(self, term: str) -> list[dict]:
+        """Entities whose whole label matches term"""
+        for variant in self._variants(term):
+            found = [id_ for id_ in self._find(variant)
+                     if self._normalized[id_] == variant]
+            if found:
+                return [self.entities[id_] for id_ in found]
+        return []
+
+    def suggest(self, term: str) -> list[dict]:
+        """Similar labels (typos), not matches"""
+        norm = normalize(term)
+        return [self.entities[id_] for id_ in self._fuzzy(norm)] \
+            if norm else []
+
+    @staticmethod
+    def _variants(term: str) -> list[str]:
+        norm = normalize(term)
+        if not norm:
+            return []
+        variants = [norm]
+        if not norm.isdigit():
+            variants += [normalize(transliterate(norm)),
+                         normalize(switch_layout(term))]
+        return list(dict.fromkeys(variants))
+
+    def _find(self, norm: str) -> list[int]:
+        if len(norm) < 3:
+            pos = bisect.bisect_left(self._sorted, (norm, -1))
+            found = []
+            while (pos < len(self._sorted)
+                   and self._sorted[pos][0].startswith(norm)):
+                found.append(self._sorted[pos][1])
+                pos += 1
+            return found
+        postings = sorted((self._trigrams.get(t, set())
+                           for t in trigrams(norm)), key=len)
+        candidates = set.intersection(*postings) if postings else set()
+        found = [id_ for id_ in candidates if norm in self._normalized[id_]]
+        # exact match first, then prefix, then substring.
+        found.sort(key=lambda id_: (
+            self._normalized[id_] != norm,
+            not self._normalized[id_].startswith(norm),
+            self._normalized[id_]
+        ))
+        return found
+
+    def _fuzzy(self, norm: str) -> list[int]:
+        query = trigrams(norm)
+        if not query:
+            return []
+        scores: dict[int, int] = {}
+        for trigram in query:
+            for id_ in self._trigrams.get(trigram, ()):
+                scores[id_] = scores.get(id_, 0) + 1
+        matched = [(count / len(query), id_) for id_, count in scores.items()
+                   if count / len(query) >= self.min_similarity]
+        matched.sort(key=lambda item: (-item[0], self._normalized[item[1]]))
+        return [id_ for _score, id_ in matched[:self.limit]]
+
+
+class LocalSearch:
+    """Searches groups and teachers locally, goes upstream on miss.
+
+    Index is complete only if catalog sync (``sync.py``) has filled db
+    no longer than ``max_age`` seconds ago. Otherwise it has just what
+    somebody searched before, so only whole label match is trusted and
+    other terms are asked upstream too.
+
+    Upstream results are saved into db and into index. Same term is not
+    requested from upstream more often than once per ``upstream_interval``.
+    """
+
+    def __init__(self, max_age: float = 24 * 60 * 60,
+                 upstream_interval: float = 20):
+        self.max_age = max_age
+        self.upstream_interval = upstream_interval
+        self.indexes = {
+            api.SearchType.GROUP: SearchIndex(),
+            api.SearchType.TEACHER: SearchIndex(),
+        }
+        self.synced_at: dict[str, float] = {}
+        self.stats = {'local': 0, 'upstream': 0}
+        self._upstream_requested: dict[tuple[str, str], float] = {}
+
+    def complete(self, search_type: str) -> bool:
+        synced_at = self.synced_at.get(search_type)
+        return synced_at is not None and \
+            time.time() - synced_at <= self.max_age
+
+    async def load(self):
+        """(Re)builds indexes from db tables"""
+        import db
+        groups, teachers = SearchIndex(), SearchIndex()
+        for group in await db.get_groups():
+            groups.add(group.id, group.label, group.description)
+        for teacher in await db.Teacher.all():
+            teachers.add(teacher.id, teacher.name, teacher.description)
+        self.indexes = {
+            api.SearchType.GROUP: groups,
+            api.SearchType.TEACHER: teachers,
+        }
+        self.synced_at = await db.CatalogSync.all()
+
+    async def search(self, term: str,
+                     search_type: str) -> list[dict[str, str | int]]:
+        """Matching entities. Typos are not matched, see ``suggest``"""
+        index = self.indexes.get(search_type)
+        if index is None:
+            return await api.search(term, search_type) or []
+        found = index.search(term) if self.complete(search_type) \
+            else index.exact(term)
+        key = (search_type, normalize(term))
+        recently = time.time() - self._upstream_requested.get(key, 0) \
+            < self.upstream_interval
+        if found or recently:
+            self.stats['local'] += 1
+            return found or index.search(term)
+        if len(self._upstream_requested) > 10000:
+            self._upstream_requested.clear()
+        self._upstream_requested[key] = time.time()
+        self.stats['upstream'] += 1
+        upstream = await api.search(term, search_type)
+        if upstream is None:  # upstream is down, local is better than none.
+            return index.search(term)
+        await self.save(upstream, search_type)
+        return upstream
+
+    def suggest(self, term: str, search_type: str) -> list[dict]:
+        """Known entities with similar labels (to offer, not to pick)"""
+        index = self.indexes.get(search_type)
+        return index.suggest(term) if index is not None else []
+
+    async def save(self, entities: list[dict], search_type: str):
+        """Saves search result page by one transaction"""
+        import db
+        index = self.indexes[search_type]
+        entities = [entity for entity in entities
+                    if entity.get('id') is not None and entity.get('label')]
+        if search_type == api.SearchType.GROUP:
+            await db.set_groups([{
+                'id': int(entity.get('id')),
+                'label': entity.get('label'),
+                'description': entity.get('description')
+            } for entity in entities])
+        else:
+            await db.Teacher.bulk_upsert([{
+                'id': int(entity.get('id')),
+                'name': entity.get('label'),
+                'description': entity.get('description')
+            } for entity in entities])
+        for entity in entities:
+            index.add(entity.get('id'), entity.get('label'),
+                      entity.get('description'))
+
+
+local_search = LocalSearch(
+    max_age=float(os.environ.get('SEARCH_INDEX_MAX_AGE', 24 * 60 * 60))
+)
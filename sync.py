@@ -0,0 +1,117 @@
+"""Catalog sync: preloads all groups and teachers from rasp.omgtu.ru into db.
+
+Usage:
+    python sync.py               # sync once
+    python sync.py --every 3600  # sync every hour
+"""
+import argparse
+import asyncio
+import logging
+import string
+import time
+
+if __name__ == '__main__':
+    # Before modules below read their settings from env on import.
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import api
+import db
+import logs
+
+log = logging.getLogger(__name__)
+
+ALPHABET = 'абвгдежзийклмнопрстуфхцчшщэюя' + string.digits
+
+
+async def crawl(search_type: str, concurrency: int = 5,
+                deepen_at: int = 100) -> dict[int, dict] | None:
+    """Collects all entities of type by searching every letter/digit.
+
+    If term gives ``deepen_at`` or more results (upstream may cut them),
+    longer terms starting with it are searched too.
+    Returns None if upstream failed, so partial catalog is not saved.
+    """
+    found: dict[int, dict] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = False
+
+    async def visit(term: str):
+        nonlocal failed
+        async with semaphore:
+            res = await api.search(term, search_type)
+        if res is None:
+            failed = True
+            return
+        for entity in res:
+            if entity.get('id') is not None and entity.get('label'):
+                found[int(entity['id'])] = entity
+        if len(res) >= deepen_at and len(term) < 2:
+            await asyncio.gather(*(visit(term + ch) for ch in ALPHABET))
+
+    await asyncio.gather(*(visit(ch) for ch in ALPHABET))
+    return None if failed else found
+
+
+async def sync_catalog() -> dict[str, dict[str, int | float]]:
+    """Crawls upstream and upserts groups and teachers. Returns report"""
+    report = {}
+    for search_type, save in (
+        (api.SearchType.GROUP, lambda rows: db.set_groups([
+            {'id': row['id'], 'label': row.get('label'),
+             'description': row.get('description')} for row in rows
+        ])),
+        (api.SearchType.TEACHER, lambda rows: db.Teacher.bulk_upsert([
+            {'id': row['id'], 'name': row.get('label'),
+             'description': row.get('description')} for row in rows
+        ])),
+    ):
+        started = time.perf_counter()
+        entities = await crawl(search_type)
+        if entities is None:
+            log.warning('Catalog sync of %s failed: upstream error',
+                        search_type)
+            continue
+        added, changed = await save(list(entities.values()))
+        await db.CatalogSync.mark(search_type, time.time())
+        report[search_type] = {
+            'fetched': len(entities),
+            'added': added,
+            'changed': changed,
+            'elapsed': round(time.perf_counter() - started, 3),
+        }
+        log.info('Catalog sync of %s: %s', search_type, report[search_type])
+    return report
+
+
+async def run_periodically(interval: float, on_synced=None):
+    """Background task, syncs catalog every ``interval`` seconds"""
+    while True:
+        try:
+            await sync_catalog()
+            if on_synced is not None:
+                await on_synced()
+        except Exception as exc:
+            log.exception('Catalog sync failed: %s', exc)
+        await asyncio.sleep(interval)
+
+
+async def main(every: float | None = None):
+    await db.migrate()  # Bot may have never started on this db.
+    try:
+        if every:
+            await run_periodically(every)
+        else:
+            for search_type, stats in (await sync_catalog()).items():
+                log.info('%s: %s', search_type, stats)
+    finally:
+        await api.client.close()
+
+
+if __name__ == '__main__':
+    logs.setup()
+    parser = argparse.ArgumentParser(
+        description='Preload groups and teachers into db.')
+    parser.add_argument('--every', type=float, default=None,
+                        help='repeat sync every N seconds')
+    asyncio.run(main(parser.parse_args().every))
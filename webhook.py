@@ -0,0 +1,132 @@
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def partition_key(update: dict) -> int:
+    """Chat id of raw update (or user id, or update id if there's no chat).
+    Updates with same key must be processed in order"""
+    for event in update.values():
+        if not isinstance(event, dict):
+            continue
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if chat and chat.get('id') is not None:
+            return int(chat['id'])
+        if (user := event.get('from')) and user.get('id') is not None:
+            return int(user['id'])
+    return int(update.get('update_id', 0))
+
+
+class WebhookServer:
+    """Receives updates by webhook and feeds them into dispatcher.
+
+    Updates are processed concurrently (at most ``max_in_flight`` at once),
+    but updates of same chat are processed one by one in order they came.
+    Update waiting for previous one of its chat doesn't take a slot, so
+    busy chat doesn't hold up others. When ``max_pending`` updates are
+    accepted and not processed yet, new ones get 503 (Telegram retries
+    them later). On shutdown server stops accepting requests and waits
+    for processing updates to finish.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, path: str = '/webhook',
+                 secret_token: str | None = None, max_in_flight: int = 100,
+                 max_pending: int = 1000, drain_timeout: float = 30):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.max_pending = max_pending
+        self.drain_timeout = drain_timeout
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._in_flight: set[asyncio.Task] = set()
+        self._chat_tails: dict[int, asyncio.Task] = {}
+        self.stats = {'received': 0, 'processed': 0, 'failed': 0,
+                      'rejected': 0}
+
+    def app(self, webhook_url: str | None = None) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+
+        async def on_startup(_app: web.Application):
+            await self.dispatcher.emit_startup(
+                dispatcher=self.dispatcher, bots=(self.bot,), bot=self.bot)
+            if webhook_url:
+                await self.bot.set_webhook(webhook_url.rstrip('/') + self.path,
+                                           secret_token=self.secret_token)
+
+        async def on_shutdown(_app: web.Application):
+            await self.drain()
+            await self.dispatcher.emit_shutdown(
+                dispatcher=self.dispatcher, bots=(self.bot,), bot=self.bot)
+            await self.bot.session.close()
+
+        app.on_startup.append(on_startup)
+        app.on_shutdown.append(on_shutdown)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and \
+                request.headers.get(SECRET_HEADER) != self.secret_token:
+            return web.Response(status=401)
+        try:
+            data = await request.json()
+            update = types.Update.model_validate(data,
+                                                 context={'bot': self.bot})
+        except ValueError:  # Bad json or not an update.
+            return web.Response(status=400)
+        if len(self._in_flight) >= self.max_pending:
+            self.stats['rejected'] += 1
+            return web.Response(status=503)
+        self.stats['received'] += 1
+        key = partition_key(data)
+        task = asyncio.create_task(
+            self._process(update, self._chat_tails.get(key)))
+        self._chat_tails[key] = task
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+        task.add_done_callback(
+            lambda t: self._chat_tails.get(key) is t
+            and self._chat_tails.pop(key)
+        )
+        return web.Response()
+
+    async def _process(self, update: types.Update,
+                       previous: asyncio.Task | None = None):
+        if previous is not None:
+            await asyncio.wait([previous])
+        await self._semaphore.acquire()
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+            self.stats['processed'] += 1
+        except Exception as exc:
+            self.stats['failed'] += 1
+            log.exception('Update %s failed: %s', update.update_id, exc)
+        finally:
+            self._semaphore.release()
+
+    async def drain(self):
+        if not self._in_flight:
+            return
+        log.info('Waiting for %d updates in flight', len(self._in_flight))
+        _done, pending = await asyncio.wait(self._in_flight,
+                                            timeout=self.drain_timeout)
+        for task in pending:
+            task.cancel()
+
+
+def run(dispatcher: Dispatcher, bot: Bot, *, host: str = '0.0.0.0',
+        port: int = 8080, path: str = '/webhook',
+        webhook_url: str | None = None, secret_token: str | None = None,
+        max_in_flight: int = 100, max_pending: int = 1000):
+    server = WebhookServer(dispatcher, bot, path=path,
+                           secret_token=secret_token,
+                           max_in_flight=max_in_flight,
+                           max_pending=max_pending)
+    web.run_app(server.app(webhook_url), host=host, port=port)
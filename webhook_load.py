@@ -0,0 +1,64 @@
+"""Posts synthetic updates to local webhook server and reports updates/s.
+
+Usage:
+    python webhook_load.py [--url http://127.0.0.1:8080/webhook]
+                           [--updates 1000] [--users 100] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import time
+
+import aiohttp
+
+from webhook import SECRET_HEADER
+
+_ids = itertools.count(1)
+
+
+def synthetic_update(user_id: int, text: str = '/start') -> dict:
+    update_id = next(_ids)
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private',
+                     'first_name': user['first_name']},
+            'from': user,
+            'text': text,
+        },
+    }
+
+
+async def main(url: str, updates: int, users: int, concurrency: int):
+    headers = {}
+    if secret := os.environ.get('WEBHOOK_SECRET'):
+        headers[SECRET_HEADER] = secret
+    counter = iter(range(updates))
+    statuses = {}
+
+    async def worker(session: aiohttp.ClientSession):
+        for i in counter:
+            async with session.post(url, headers=headers,
+                                    json=synthetic_update(i % users + 1)) as r:
+                statuses[r.status] = statuses.get(r.status, 0) + 1
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    print(f'{updates} updates in {elapsed:.2f}s: '
+          f'{updates / elapsed:.1f} updates/s, statuses: {statuses}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8080/webhook')
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.updates, args.users, args.concurrency))